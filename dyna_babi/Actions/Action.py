@@ -24,6 +24,11 @@ class Action(object):
         self.kind = kind
         self.world = world
         
+    def sub_actions(self):
+        """
+        Actions this action performs (for actions composed of other actions)
+        """
+        return []
         
     def valid_actions(self):
         return []
\ No newline at end of file
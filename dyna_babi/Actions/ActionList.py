@@ -51,6 +51,19 @@ class ActionList(object):
             if action == "indef":
                 self.actions.append(IndefAction.IndefAction(self.world))
 
+    def action_kinds(self):
+        """
+        Kinds of all actions that can be performed, including the actions that composite actions (e.g., coref)
+        are made of.
+        """
+        kinds = set()
+        to_visit = list(self.actions)
+        while to_visit:
+            action = to_visit.pop()
+            kinds.add(action.kind)
+            to_visit += action.sub_actions()
+        return kinds
+
     def can_act(self, persons=None):
         """
         Can any action be performed. Note that in the usual case we have at least one person and two locations,
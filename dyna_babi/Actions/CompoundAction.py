@@ -14,6 +14,9 @@ class CompoundAction(Action):
         self.base_action = ConjAction(self.world)
         self.initialize()
 
+    def sub_actions(self):
+        return [self.base_action]
+
     def initialize(self):
         entities = self.world.entities
         for entity in entities:
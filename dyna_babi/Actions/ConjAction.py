@@ -16,6 +16,9 @@ class ConjAction(Action):
         self.base_action = MoveAction(self.world)
         self.initialize()
 
+    def sub_actions(self):
+        return [self.base_action]
+
     def initialize(self):
         entities = self.world.entities
         for entity in entities:
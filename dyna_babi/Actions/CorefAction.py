@@ -28,6 +28,9 @@ class CorefAction(Action):
 
         self.action_list.init_from_params(self.world.params.coref, self.world.params.coref_distribution)
 
+    def sub_actions(self):
+        return self.action_list.actions
+
     def is_valid(self, persons=None):
         """
         True iff at least one action from self.action_list is valid
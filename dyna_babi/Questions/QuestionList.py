@@ -2,6 +2,39 @@ import numpy as np
 import numpy.random as random
 from . import WherePersonQuestion, WhereObjectQuestion, WhereWasObjectQuestion, GivingQuestion, YesNoQuestion, CountingQuestion, ListQuestion
 
+# trackers whose state other questions read (via `world.get_question_by_kind`)
+QUESTION_DEPENDENCIES = {"where_person": {"where_object"},
+                         "yes_no": {"where_object"}}
+# trackers whose state actions read (`match_locations` of grab/give)
+ACTION_DEPENDENCIES = {"grab": {"where_person", "where_object"},
+                       "give": {"where_person"}}
+# trackers that record propositions of the world (`world.diff_props`)
+PROP_TRACKERS = {"where_object"}
+
+
+def required_trackers(questions, actions, track_props=True):
+    """
+    Kinds of question trackers needed to ask `questions` in a world with
+    `actions`, including the trackers those depend on.
+    :param questions: a list of question names (strings)
+    :param actions: kinds of the actions of the world (strings)
+    :param track_props: if the world tracks propositions
+    """
+    required = set(questions)
+    for action in actions:
+        required |= ACTION_DEPENDENCIES.get(action, set())
+    if track_props:
+        required |= PROP_TRACKERS
+    
+    # add dependencies of required trackers, until no new ones are added
+    to_visit = list(required)
+    while to_visit:
+        for dependency in QUESTION_DEPENDENCIES.get(to_visit.pop(), set()):
+            if dependency not in required:
+                required.add(dependency)
+                to_visit.append(dependency)
+    return required
+
 
 class QuestionList(object):
     """
@@ -20,12 +53,16 @@ class QuestionList(object):
         self.world = world
         self.questions = questions
         self.distribution = distribution
+        # questions updated with known items, others aren't needed by the world
+        self.active_questions = self.questions
 
-    def init_from_params(self, questions, distribution):
+    def init_from_params(self, questions, distribution, actions=None):
         """
             Creates Question objects for the question names in "questions" and adds them to self.questions
             :param questions: a list of legal question names (strings)
             :param distribution: the distribution from which to choose an questions when requested
+            :param actions: kinds of the actions of the world (strings). If given, only
+                            the questions needed for "questions" and "actions" track known items
             """
         self.distribution = distribution
         for question in questions:
@@ -51,13 +88,17 @@ class QuestionList(object):
         if not [question for question in self.questions if question.kind == "where_object"]:
             self.questions.append(WhereObjectQuestion.WhereObjectQuestion(world=self.world))
             self.distribution.append(0.0)
+        
+        if actions is not None:
+            required = required_trackers(questions, actions, track_props=self.world.track_props)
+            self.active_questions = [question for question in self.questions if question.kind in required]
 
     def add_known_item(self, a, b, match_location=None):
         """
         Adds new information about an entity, that should be known the reader of a bAbI story (if the reader reads well)
         Usually a will be some entity and b will be the entity that is known to hold a (but not necessarily).
         """
-        for question in self.questions:
+        for question in self.active_questions:
             question.add_known_item(a, b, t=self.world.timestep,
                                     match_location=match_location)
 
@@ -66,14 +107,14 @@ class QuestionList(object):
         Adds new information about an entity, that should be known the reader of a bAbI story (if the reader reads well)
         Usually a will be some entity and b will be the entity that is known to  no longer hold a (but not necessarily).
         """
-        for question in self.questions:
+        for question in self.active_questions:
             question.remove_known_item(a, b)
 
     def forget(self):
         """
         Deletes all previous information about what is holding what.
         """
-        for question in self.questions:
+        for question in self.active_questions:
             question.forget()
 
     def can_ask(self):
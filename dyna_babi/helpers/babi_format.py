@@ -0,0 +1,139 @@
+"""
+Parsed form of bAbI story lines and stories.
+
+Lines are parsed once into `BabiLine`s (line number, text, answer and supporting
+facts of questions), so line numbers and supporting facts can be renumbered as
+integers and each line re-serialized once, instead of re-splitting and
+regex-scanning the raw line in every helper that touches it.
+"""
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from dataclasses import dataclass, field
+from pathlib import Path
+import re
+
+from .compression import open_text
+
+IDX_RE = re.compile(r"^(\d+)(?:\s+)")
+
+
+@dataclass
+class BabiLine:
+    """
+    A line of a bAbI story: `idx text` for sentences, and
+    `idx question\\tanswer\\tsupporting facts` for questions.
+    """
+    idx: int
+    text: str
+    answer: Optional[str] = None # None for sentences
+    supports: List[int] = field(default_factory=list)
+    end: str = "\n" # line ending, "" if none
+
+    @property
+    def is_question(self) -> bool:
+        return self.answer is not None
+
+    @classmethod
+    def parse(cls, line: str) -> "BabiLine":
+        match = IDX_RE.match(line)
+        if not match:
+            raise ValueError(f"Not a bAbI line (missing line number): {line!r}")
+        rest = line[match.end():]
+        end = "\n" if rest.endswith("\n") else ""
+        rest = rest[:len(rest)-len(end)]
+        if "\t" in rest:
+            # supporting facts may be missing (e.g., questions of SST stories)
+            text, answer, *supports = rest.split("\t", 2)
+            supports = [int(s) for s in supports[0].split()] if supports else []
+            return cls(int(match.group(1)), text, answer, supports, end)
+        return cls(int(match.group(1)), rest, end=end)
+
+    def to_str(self) -> str:
+        if self.is_question:
+            supports = " ".join(str(s) for s in self.supports)
+            return f"{self.idx} {self.text}\t{self.answer}\t{supports}{self.end}"
+        return f"{self.idx} {self.text}{self.end}"
+
+    def renumbered(self, new_idx: int, supports_map: Dict[int, int] = None) -> "BabiLine":
+        """
+        Copy of the line with index `new_idx`, and supporting facts in
+        `supports_map` replaced by their mapped values.
+        """
+        supports = self.supports
+        if supports_map:
+            supports = [supports_map.get(s, s) for s in supports]
+        return BabiLine(new_idx, self.text, self.answer, list(supports), self.end)
+
+    def question_answer(self) -> Tuple[str, str]:
+        """
+        Question text (whitespace normalized, ending with "?") and answer (without
+        supporting fact numbers) of a question line.
+        """
+        assert self.is_question, f"Not a question line: {self.to_str()!r}"
+        question = " ".join(self.text.split()).split("?")[0]
+        answer = " ".join(w for w in self.answer.split() if not w.isnumeric())
+        return f"{question}?", answer
+
+
+@dataclass
+class BabiStory:
+    """
+    Parsed lines of a single bAbI story.
+    """
+    lines: List[BabiLine] = field(default_factory=list)
+
+    @classmethod
+    def parse(cls, lines: Iterable[str]) -> "BabiStory":
+        return cls([BabiLine.parse(line) for line in lines])
+
+    def to_lines(self) -> List[str]:
+        return [line.to_str() for line in self.lines]
+
+    def renumbered(self) -> "BabiStory":
+        """
+        Copy of the story with lines numbered 1..n, and supporting facts of
+        questions mapped to the new line numbers.
+        """
+        old_to_new = {line.idx: t for t, line in enumerate(self.lines, 1)}
+        return BabiStory([line.renumbered(t, old_to_new)
+                          for t, line in enumerate(self.lines, 1)])
+
+
+def story_starts(lines: List[str]) -> List[int]:
+    """
+    Positions of the first line of each story (line number 1) in `lines`.
+    """
+    starts = []
+    for i, line in enumerate(lines):
+        match = IDX_RE.match(line)
+        if match and match.group(1) == "1":
+            starts.append(i)
+    return starts
+
+
+def split_story_lines(lines: List[str]) -> List[List[str]]:
+    """
+    Break lines of stories in bAbI format into a list of stories' lines.
+    """
+    starts = story_starts(lines[:-1]) + [len(lines)]
+    return [lines[starts[i]:starts[i+1]] for i in range(len(starts)-1)]
+
+
+def iter_babi_file(path: Path) -> Iterator[BabiStory]:
+    """
+    Iterate over the parsed stories of a (possibly compressed) bAbI file,
+    parsing each line once.
+    """
+    story = None
+    with open_text(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            parsed = BabiLine.parse(line)
+            if parsed.idx == 1 and story is not None:
+                yield story
+                story = None
+            if story is None:
+                story = BabiStory()
+            story.lines.append(parsed)
+    if story is not None:
+        yield story
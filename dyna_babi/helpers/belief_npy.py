@@ -0,0 +1,104 @@
+"""
+Export of story belief matrices (see `BeliefMatrix`) as `.npy` tensors.
+"""
+from typing import Callable, Dict, List
+from pathlib import Path
+import json
+import os
+
+import numpy as np
+
+from .stream_writers import PARTIAL_SUFFIX, tt_split_name
+from .sst.belief_base import BeliefMatrix
+from .sst.proposition import ProbProposition
+
+BELIEF_STORIES_SUFFIX = "_belief_stories.jsonl"
+
+
+class BeliefNpyWriter:
+    """
+    Writes the belief matrices of a split's stories as `.npy` supervision
+    tensors, without building SST instances:
+        - `<split>_beliefs.npy`: float32 (total timesteps x n_props) matrix of the
+          beliefs at each timestep of each story (rows of stories are consecutive).
+        - `<split>_belief_stories.jsonl`: uid, seed, first row and number of rows
+          of each story.
+        - `belief_props.json`: propositions of the matrix columns.
+    
+    Rows are streamed to a partial file as stories are written, and the `.npy`
+    header is added on commit, once the stories to keep and their number of
+    rows are known.
+    """
+    def __init__(self, out_dir: Path, split: str, prop2idx: Dict[str, int]):
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        self.props = sorted(prop2idx, key=prop2idx.get)
+        self.prop2idx = prop2idx
+        self.path = out_dir / f"{tt_split_name(split)}_beliefs.npy"
+        self.stories_path = out_dir / f"{tt_split_name(split)}{BELIEF_STORIES_SUFFIX}"
+        self.props_path = out_dir / "belief_props.json"
+        self.partial_path = self.path.with_name(self.path.name + PARTIAL_SUFFIX)
+        self._rows_f = self.partial_path.open("wb")
+        self._stories = []
+        self.n_rows = 0
+    
+    @property
+    def closed(self) -> bool:
+        return self._rows_f.closed
+    
+    def write_story(self, dec_story, diff_props: Dict[int, List[ProbProposition]], n_timesteps: int = 0,
+                    old_new_map: Dict[int, int] = None):
+        """
+        Write the beliefs at each timestep of `dec_story`. If the story was filtered
+        out of a longer generated story (`diff_props`, `n_timesteps`), `old_new_map`
+        maps the kept timesteps to those of `dec_story`.
+        """
+        beliefs = BeliefMatrix(diff_props, self.prop2idx, n_timesteps=n_timesteps).timestep_beliefs()
+        if old_new_map:
+            beliefs = beliefs[[t - 1 for t in sorted(old_new_map, key=old_new_map.get)]]
+        assert beliefs.shape[1] == len(self.props), \
+            f"Story {dec_story.uid} has propositions missing from prop2idx"
+        assert len(beliefs) == len(dec_story.babi_story), \
+            f"Story {dec_story.uid} has {len(dec_story.babi_story)} timesteps but {len(beliefs)} belief rows"
+        self._rows_f.write(beliefs.tobytes())
+        self._stories.append({"uid": dec_story.uid, "seed": dec_story.seed,
+                              "start": self.n_rows, "n_rows": len(beliefs)})
+        self.n_rows += len(beliefs)
+    
+    def commit(self, keep_uid: Callable[[str], bool] = None):
+        """
+        Write out the tensors. If `keep_uid` is given, only the rows of stories
+        whose uid it accepts are kept (e.g., the subsampled stories of a split).
+        """
+        if self.closed:
+            return
+        self._rows_f.close()
+        stories = [story for story in self._stories if keep_uid is None or keep_uid(story["uid"])]
+        n_rows = sum(story["n_rows"] for story in stories)
+        row_size = len(self.props) * np.dtype(np.float32).itemsize
+        
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with tmp_path.open("wb") as f_out, self.partial_path.open("rb") as f_rows:
+            np.lib.format.write_array_header_1_0(f_out, {"descr": np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+                                                          "fortran_order": False,
+                                                          "shape": (n_rows, len(self.props))})
+            start = 0
+            for story in stories:
+                f_rows.seek(story["start"] * row_size)
+                f_out.write(f_rows.read(story["n_rows"] * row_size))
+                story["start"] = start
+                start += story["n_rows"]
+        os.replace(tmp_path, self.path)
+        self.partial_path.unlink()
+        self.stories_path.write_text("\n".join(json.dumps(story) for story in stories))
+        self.props_path.write_text(json.dumps(self.props))
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            # leave the partial file in place for inspection
+            self._rows_f.close()
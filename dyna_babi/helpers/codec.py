@@ -0,0 +1,151 @@
+"""
+Schema-specific JSON encoding/decoding of DECStory, TransformerInstance and
+InstanceSST objects.
+
+Encoding produces exactly the same output as `dataclasses_json`'s `to_json()`
+(field order, separators, int dict keys as strings, sets as lists), without its
+per-field reflection. Decoding restores objects directly from their fields,
+without re-running `__post_init__` validation. Parsing uses `orjson` if it is
+installed, and the standard `json` module otherwise.
+"""
+from typing import Dict, Tuple, Type, Union
+from collections.abc import Collection, Mapping
+from dataclasses import fields
+from enum import Enum
+import json
+
+from .event_calc import DECStory, DECEvent
+from .transformer_preproc import TransformerInstance
+from .sst.instance_sst import InstanceSST
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# bump when the fields of any of the encoded classes change
+SCHEMA_VERSION = 1
+
+DEC_EVENT_FIELDS = ("timestep", "kind", "source", "target", "ternary", "is_coref",
+                    "is_conj", "is_q", "is_all_act", "gold_belief", "supporting_facts",
+                    "implicit_facts", "chosen_q", "sub_kind")
+DEC_STORY_FIELDS = ("seed", "events", "babi_story", "coref_map", "ie_answers",
+                    "ie_s_facts", "uid", "task")
+TI_FIELDS = ("id", "task", "seed", "q_sub_id", "input", "output", "answerKey",
+             "prefix", "question", "supporting_facts", "chosen_q")
+SST_FIELDS = ("texts", "outputs", "prop_lists", "question", "answer", "supporting_facts",
+              "prop_times", "uid", "seed", "q_sub_id", "guid", "task")
+
+# dict fields with int keys (encoded as strings in json)
+INT_KEY_FIELDS = ("ie_answers", "ie_s_facts")
+
+SCHEMAS = {
+    DECEvent: DEC_EVENT_FIELDS,
+    DECStory: DEC_STORY_FIELDS,
+    TransformerInstance: TI_FIELDS,
+    InstanceSST: SST_FIELDS
+    }
+
+
+def check_schemas():
+    """
+    Make sure the codec schemas match the current dataclass definitions.
+    """
+    for cls, schema_fields in SCHEMAS.items():
+        cls_fields = tuple(f.name for f in fields(cls))
+        if cls_fields != schema_fields:
+            raise ValueError(f"Codec schema (version {SCHEMA_VERSION}) of {cls.__name__} "
+                             f"doesn't match its fields {cls_fields}, update the codec schema.")
+
+check_schemas()
+
+
+def _default(obj):
+    # same fallbacks as dataclasses_json's encoder
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if isinstance(obj, Collection) and not isinstance(obj, str):
+        return list(obj)
+    if isinstance(obj, Enum):
+        return obj.value
+    return json.JSONEncoder().default(obj)
+
+
+def dumps(obj) -> str:
+    return json.dumps(obj, default=_default)
+
+
+def loads(data: Union[str, bytes]):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _event_dict(ev: DECEvent) -> Dict:
+    return {name: getattr(ev, name) for name in DEC_EVENT_FIELDS}
+
+
+def dec_story_to_dict(dec_story: DECStory) -> Dict:
+    d = {name: getattr(dec_story, name) for name in DEC_STORY_FIELDS}
+    d["events"] = [[_event_dict(ev) for ev in t_evs] for t_evs in dec_story.events]
+    return d
+
+
+def _matches_schema(d: Dict, schema_fields: Tuple[str]) -> bool:
+    return len(d) == len(schema_fields) and all(name in d for name in schema_fields)
+
+
+def _restore(cls: Type, d: Dict, schema_fields: Tuple[str]):
+    if not _matches_schema(d, schema_fields):
+        # missing/extra fields (e.g., older files), fall back to full decoding
+        return cls.from_dict(d)
+    obj = object.__new__(cls)
+    obj.__dict__.update(d)
+    return obj
+
+
+def dec_event_from_dict(d: Dict) -> DECEvent:
+    ev = _restore(DECEvent, d, DEC_EVENT_FIELDS)
+    # normalizations of DECEvent.__post_init__
+    if ev.ternary is None:
+        ev.ternary = []
+    ev.supporting_facts = sorted(ev.supporting_facts)
+    return ev
+
+
+def dec_story_from_dict(d: Dict) -> DECStory:
+    if not _matches_schema(d, DEC_STORY_FIELDS):
+        return DECStory.from_dict(d)
+    d = dict(d)
+    d["events"] = [[dec_event_from_dict(ev) for ev in t_evs] for t_evs in d["events"]]
+    for name in INT_KEY_FIELDS:
+        if d[name]:
+            d[name] = {int(k): v for k, v in d[name].items()}
+    dec_story = _restore(DECStory, d, DEC_STORY_FIELDS)
+    dec_story.seed = int(dec_story.seed)
+    return dec_story
+
+
+def encode_dec_story(dec_story: DECStory) -> str:
+    return dumps(dec_story_to_dict(dec_story))
+
+
+def decode_dec_story(data: Union[str, bytes]) -> DECStory:
+    return dec_story_from_dict(loads(data))
+
+
+def encode_transformer_instance(ti: TransformerInstance) -> str:
+    return dumps({name: getattr(ti, name) for name in TI_FIELDS})
+
+
+def decode_transformer_instance(data: Union[str, bytes]) -> TransformerInstance:
+    # restored as written, `__post_init__` would add the q_sub_id suffix to the id again
+    return _restore(TransformerInstance, loads(data), TI_FIELDS)
+
+
+def encode_instance_sst(inst: InstanceSST) -> str:
+    return dumps({name: getattr(inst, name) for name in SST_FIELDS})
+
+
+def decode_instance_sst(data: Union[str, bytes]) -> InstanceSST:
+    return _restore(InstanceSST, loads(data), SST_FIELDS)
@@ -0,0 +1,202 @@
+"""
+Optional columnar (Parquet) export of DEC stories, with one table row per question
+and one row per story sentence. Requires `pyarrow` (pip install pyarrow).
+"""
+from typing import List, Dict, Iterable
+from pathlib import Path
+import os
+
+from .event_calc import DECStory
+from .stream_writers import PARTIAL_SUFFIX, tt_split_name
+from .transformer_preproc import process_line
+from .babi_format import BabiLine
+
+QUESTIONS_SUFFIX = "questions"
+SENTENCES_SUFFIX = "sentences"
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Columnar output requires pyarrow, install it with "
+                          "`pip install pyarrow`.") from e
+    return pa, pq
+
+
+def question_schema():
+    pa, _ = _import_pyarrow()
+    dict_str = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("uid", pa.string()),
+        ("seed", pa.int64()),
+        ("task", dict_str),
+        ("q_sub_id", pa.int32()),
+        ("kind", dict_str),
+        ("sub_kind", dict_str),
+        ("question", pa.string()),
+        ("answer", dict_str),
+        ("supporting_facts", pa.list_(pa.int32())),
+        ("story_length", pa.int32()),
+        ("signature", pa.string()),
+        ("chosen_q", pa.bool_()),
+        ])
+
+
+def sentence_schema():
+    pa, _ = _import_pyarrow()
+    dict_str = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("uid", pa.string()),
+        ("timestep", pa.int32()),
+        ("text", pa.string()),
+        ("is_q", pa.bool_()),
+        ("kind", dict_str),
+        ("entities", pa.list_(dict_str)),
+        ])
+
+
+def dec_story_question_rows(dec_story: DECStory) -> List[Dict]:
+    """
+    Return one row per question of the story.
+    """
+    rows = []
+    for q_timestep in dec_story.question_sent_idxs():
+        q_ev = dec_story.ev_by_timestep(q_timestep)[0]
+        question, answer = BabiLine.parse(dec_story.babi_story[q_timestep-1]).question_answer()
+        rows.append({
+            "uid": dec_story.uid,
+            "seed": dec_story.seed,
+            "task": dec_story.task,
+            "q_sub_id": q_timestep,
+            "kind": q_ev.kind,
+            "sub_kind": q_ev.sub_kind,
+            "question": question,
+            "answer": answer,
+            "supporting_facts": q_ev.supporting_facts,
+            "story_length": len(dec_story.story_sent_idxs(q_timestep)),
+            "signature": dec_story.q_sig_str(q_timestep),
+            "chosen_q": q_ev.chosen_q
+            })
+    return rows
+
+
+def dec_story_sentence_rows(dec_story: DECStory) -> List[Dict]:
+    """
+    Return one row per sentence (including questions) of the story.
+    """
+    rows = []
+    for evs in dec_story.events:
+        t = evs[0].timestep
+        entities = []
+        for ev in evs:
+            for arg in ev.source + ev.target + ev.ternary:
+                # question targets (answers) may be nested lists
+                args = arg if isinstance(arg, list) else [arg]
+                entities += [a for a in args if a not in entities]
+        rows.append({
+            "uid": dec_story.uid,
+            "timestep": t,
+            "text": process_line(dec_story.babi_story[t-1]),
+            "is_q": evs[0].is_q,
+            "kind": evs[0].kind,
+            "entities": entities
+            })
+    return rows
+
+
+class ParquetTableWriter:
+    """
+    Writes rows to a Parquet file in batches of `batch_size` rows. Like
+    `AtomicWriter`, data goes to `<path>.partial` until `commit()` is called.
+    """
+    def __init__(self, path: Path, schema, batch_size: int = 4096):
+        pa, pq = _import_pyarrow()
+        self._pa = pa
+        self.path = Path(path)
+        self.partial_path = self.path.with_name(self.path.name + PARTIAL_SUFFIX)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.schema = schema
+        self.batch_size = batch_size
+        self._rows = []
+        self._writer = pq.ParquetWriter(str(self.partial_path), schema)
+        self.closed = False
+
+    def write_rows(self, rows: Iterable[Dict]):
+        self._rows.extend(rows)
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            columns = {name: [r[name] for r in self._rows] for name in self.schema.names}
+            self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self.schema))
+            self._rows = []
+
+    def commit(self):
+        if not self.closed:
+            self.flush()
+            self._writer.close()
+            self.closed = True
+            os.replace(self.partial_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+        elif not self.closed:
+            self._writer.close()
+            self.closed = True
+
+
+class ColumnarWriter:
+    """
+    Writes question and sentence tables of a split's stories, to
+    `dec_{split}_questions.parquet` and `dec_{split}_sentences.parquet`.
+    """
+    def __init__(self, out_dir: Path, split: str, batch_size: int = 4096):
+        out_dir = Path(out_dir)
+        prefix = f"dec_{tt_split_name(split)}"
+        self.questions_writer = ParquetTableWriter(out_dir / f"{prefix}_{QUESTIONS_SUFFIX}.parquet",
+                                                   question_schema(), batch_size=batch_size)
+        self.sentences_writer = ParquetTableWriter(out_dir / f"{prefix}_{SENTENCES_SUFFIX}.parquet",
+                                                   sentence_schema(), batch_size=batch_size)
+
+    @property
+    def writers(self) -> list:
+        return [self.questions_writer, self.sentences_writer]
+
+    @property
+    def closed(self) -> bool:
+        return all(w.closed for w in self.writers)
+
+    def write_story(self, dec_story: DECStory):
+        self.questions_writer.write_rows(dec_story_question_rows(dec_story))
+        self.sentences_writer.write_rows(dec_story_sentence_rows(dec_story))
+
+    def flush(self):
+        for w in self.writers:
+            w.flush()
+
+    def commit(self):
+        for w in self.writers:
+            w.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for w in self.writers:
+            w.__exit__(exc_type, exc_val, exc_tb)
+
+
+def read_table(path: Path, columns: List[str] = None, filters=None):
+    """
+    Load a question/sentence table (memory-mapped), optionally only reading
+    the given `columns` and rows matching `filters` (see `pyarrow.parquet.read_table`).
+    """
+    _, pq = _import_pyarrow()
+    return pq.read_table(str(path), columns=columns, filters=filters, memory_map=True)
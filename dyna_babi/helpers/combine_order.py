@@ -0,0 +1,177 @@
+"""
+Story-level shuffling and interleaving of multi-task output files.
+
+Files are split into stories (bAbI stories start at line "1 ", DEC files have one
+story per line, and consecutive TT lines of the same story share its uid), and
+each story's lines are kept contiguous in the combined file.
+
+Shuffling is done out of memory: every story is assigned a random sort key from
+a seeded rng, and stories are spilled to temporary bucket files by key range,
+so only a single bucket has to be held in memory at a time. The resulting order
+depends only on the seed and the sequence of stories (not on the number of
+buckets), so the bAbI, DEC and TT files of the same tasks are shuffled the same
+way.
+"""
+from typing import Iterator, List
+from pathlib import Path
+import math
+import re
+import struct
+import tempfile
+
+import numpy as np
+
+from .compression import open_text, path_compression, strip_compression_suffix
+from .stream_writers import AtomicWriter
+
+COMBINE_ORDERS = ("concat", "shuffle", "interleave")
+MAX_BUCKET_BYTES = 256 * 1024 * 1024
+MAX_BUCKETS = 512 # bucket files are open at the same time
+EST_COMPRESSION_RATIO = 8 # rough size ratio of uncompressed/compressed files
+KEYS_BATCH_SIZE = 4096
+
+# story uid of DEC lines, or of TT lines (ids are <uid>_<question id>)
+STORY_UID_RE = re.compile(r'"u?id": "([^"]*?)(?:_\d+)?"')
+FRAME = struct.Struct("<dQI") # sort key, story index, length
+
+
+def check_combine_order(order: str):
+    if order not in COMBINE_ORDERS:
+        raise ValueError(f"Unsupported combine order {order}, choose one of {list(COMBINE_ORDERS)}")
+
+
+def _iter_babi_stories(f) -> Iterator[str]:
+    lines = []
+    for line in f:
+        if not line.strip():
+            continue
+        if line.startswith("1 ") and lines:
+            yield "".join(lines)
+            lines = []
+        lines.append(line if line.endswith("\n") else line + "\n")
+    if lines:
+        yield "".join(lines)
+
+
+def _iter_jsonl_stories(f) -> Iterator[str]:
+    lines, story_key = [], None
+    for line in f:
+        if not line.strip():
+            continue
+        match = STORY_UID_RE.search(line)
+        key = match.group(1) if match else None
+        if lines and (key is None or key != story_key):
+            yield "".join(lines)
+            lines = []
+        story_key = key
+        lines.append(line if line.endswith("\n") else line + "\n")
+    if lines:
+        yield "".join(lines)
+
+
+def iter_file_stories(path: Path) -> Iterator[str]:
+    """
+    Iterate over the stories of a (possibly compressed) bAbI (.txt) or
+    DEC/TT (.jsonl) file, yielding the text of each story (all its lines).
+    """
+    path = Path(path)
+    iter_stories = _iter_jsonl_stories if strip_compression_suffix(path).suffix == ".jsonl" \
+        else _iter_babi_stories
+    with open_text(path) as f:
+        yield from iter_stories(f)
+
+
+def _open_target(target_file: Path) -> AtomicWriter:
+    target_file = Path(target_file)
+    return AtomicWriter(strip_compression_suffix(target_file),
+                        compression=path_compression(target_file))
+
+
+def interleave_files(source_files: List[Path], target_file: Path):
+    """
+    Write the stories of `source_files` to `target_file` round-robin, one story
+    from each source file at a time, until all files are exhausted.
+    """
+    iters = [iter_file_stories(f) for f in source_files]
+    with _open_target(target_file) as f_out:
+        while iters:
+            active = []
+            for it in iters:
+                story = next(it, None)
+                if story is not None:
+                    f_out.write(story)
+                    active.append(it)
+            iters = active
+
+
+def _estimated_size(path: Path) -> int:
+    size = Path(path).stat().st_size
+    return size * EST_COMPRESSION_RATIO if path_compression(path) else size
+
+
+def _read_bucket(bucket_file: Path) -> List:
+    stories = []
+    with bucket_file.open("rb") as f:
+        while True:
+            header = f.read(FRAME.size)
+            if not header:
+                break
+            key, i, length = FRAME.unpack(header)
+            stories.append((key, i, f.read(length)))
+    return stories
+
+
+def shuffle_files(source_files: List[Path], target_file: Path, seed: int = 0,
+                  max_bucket_bytes: int = MAX_BUCKET_BYTES):
+    """
+    Write the stories of `source_files` to `target_file` in a random order,
+    determined by `seed`. Memory use is bounded by `max_bucket_bytes` (roughly,
+    the size of compressed files is estimated).
+    """
+    target_file = Path(target_file)
+    total_size = sum(_estimated_size(f) for f in source_files)
+    n_buckets = min(max(1, math.ceil(total_size / max_bucket_bytes)), MAX_BUCKETS)
+    rng = np.random.RandomState(seed)
+    keys = []
+
+    with tempfile.TemporaryDirectory(dir=target_file.parent,
+                                     prefix=f".{target_file.name}.") as tmp_dir:
+        bucket_files = [Path(tmp_dir) / f"bucket_{b}" for b in range(n_buckets)]
+        buckets = [bf.open("wb") for bf in bucket_files]
+        try:
+            i = 0
+            for source_file in source_files:
+                for story in iter_file_stories(source_file):
+                    if i % KEYS_BATCH_SIZE == 0:
+                        keys = rng.random_sample(KEYS_BATCH_SIZE)
+                    key = float(keys[i % KEYS_BATCH_SIZE])
+                    data = story.encode("utf-8")
+                    bucket = buckets[min(int(key * n_buckets), n_buckets - 1)]
+                    bucket.write(FRAME.pack(key, i, len(data)))
+                    bucket.write(data)
+                    i += 1
+        finally:
+            for bucket in buckets:
+                bucket.close()
+
+        # bucket key ranges are in order, so sorting each bucket sorts all stories
+        with _open_target(target_file) as f_out:
+            for bucket_file in bucket_files:
+                for _, _, data in sorted(_read_bucket(bucket_file)):
+                    f_out.write(data.decode("utf-8"))
+                bucket_file.unlink()
+
+
+def combine_files_ordered(source_files: List[Path], target_file: Path, order: str = "shuffle",
+                          seed: int = 0):
+    """
+    Combine stories of `source_files` to `target_file` in a shuffled or interleaved
+    order (concatenation is done by `tasks_writer.combine_files`).
+    """
+    check_combine_order(order)
+    if order == "shuffle":
+        shuffle_files(source_files, target_file, seed=seed)
+    elif order == "interleave":
+        interleave_files(source_files, target_file)
+    else:
+        raise ValueError("Use `combine_files` to concatenate files.")
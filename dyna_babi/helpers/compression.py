@@ -0,0 +1,180 @@
+"""
+Compressed output files (gzip, xz and optional zstd), and transparent reading of
+compressed or plain text files.
+"""
+from typing import List
+from pathlib import Path
+import gzip
+import lzma
+import os
+import queue
+import shutil
+import threading
+
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "xz": ".xz", "zstd": ".zst"}
+COPY_BUFSIZE = 1024 * 1024
+SUFFIX_COMPRESSIONS = {v: k for k, v in COMPRESSION_SUFFIXES.items()}
+
+
+def check_compression(compression: str):
+    if compression and compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Unsupported compression {compression}, "
+                         f"choose one of {list(COMPRESSION_SUFFIXES.keys())}")
+
+
+def compressed_path(path: Path, compression: str = None) -> Path:
+    """
+    Return `path` with the suffix of `compression` appended (e.g. train.txt -> train.txt.gz).
+    """
+    path = Path(path)
+    if not compression:
+        return path
+    check_compression(compression)
+    return path.with_name(path.name + COMPRESSION_SUFFIXES[compression])
+
+
+def path_compression(path: Path) -> str:
+    """
+    Return compression of file, inferred from its suffix (None if not compressed).
+    """
+    return SUFFIX_COMPRESSIONS.get(Path(path).suffix)
+
+
+def strip_compression_suffix(path: Path) -> Path:
+    path = Path(path)
+    if path_compression(path):
+        return path.with_suffix("")
+    return path
+
+
+def with_compression_suffixes(patterns: List[str]) -> List[str]:
+    """
+    Extend glob patterns to also match compressed versions of the files.
+    """
+    return [p + suffix for p in patterns for suffix in [""] + list(COMPRESSION_SUFFIXES.values())]
+
+
+def _open_zstd(path: Path, mode: str):
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("zstd compression requires zstandard, install it with "
+                          "`pip install zstandard`.") from e
+    return zstandard.open(str(path), mode, encoding="utf-8" if "b" not in mode else None)
+
+
+def compress_bytes(data: bytes, compression: str = None) -> bytes:
+    """
+    Compress `data` as a complete compressed stream (no-op if `compression` is None).
+    """
+    if compression == "gzip":
+        return gzip.compress(data)
+    elif compression == "xz":
+        return lzma.compress(data)
+    elif compression == "zstd":
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError("zstd compression requires zstandard, install it with "
+                              "`pip install zstandard`.") from e
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def copy_file_data(f_in, f_out):
+    """
+    Copy contents of binary file `f_in` to the current position of `f_out`, 
+    using zero-copy `os.sendfile` where supported.
+    """
+    f_out.flush()
+    offset = 0
+    try:
+        in_fd, out_fd = f_in.fileno(), f_out.fileno()
+        while True:
+            sent = os.sendfile(out_fd, in_fd, offset, COPY_BUFSIZE)
+            if sent == 0:
+                break
+            offset += sent
+    except (AttributeError, OSError):
+        if offset > 0:
+            raise
+        # sendfile not supported, fall back to buffered copy
+        shutil.copyfileobj(f_in, f_out, COPY_BUFSIZE)
+
+
+def open_text(path: Path, mode: str = "r", compression: str = None):
+    """
+    Open a (possibly compressed) text file. If `compression` is not given, it is
+    inferred from the file suffix.
+    """
+    path = Path(path)
+    compression = compression if compression else path_compression(path)
+    mode = mode if "t" in mode else mode + "t"
+    if compression == "gzip":
+        return gzip.open(path, mode, encoding="utf-8")
+    elif compression == "xz":
+        return lzma.open(path, mode, encoding="utf-8")
+    elif compression == "zstd":
+        return _open_zstd(path, mode)
+    return path.open(mode.replace("t", ""))
+
+
+def read_text(path: Path) -> str:
+    with open_text(path) as f:
+        return f.read()
+
+
+def read_lines(path: Path) -> List[str]:
+    with open_text(path) as f:
+        return f.readlines()
+
+
+class ThreadedCompressedFile:
+    """
+    Text file object that compresses in a background thread: `write()` only
+    queues the data, and the compression and disk writes happen in a worker
+    thread. Errors raised in the worker are re-raised on `close()`.
+    """
+    _DONE = None
+
+    def __init__(self, path: Path, compression: str, max_queued: int = 1024):
+        check_compression(compression)
+        self._f = open_text(path, "w", compression=compression)
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._error = None
+        self.closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is self._DONE:
+                break
+            if self._error is None:
+                try:
+                    self._f.write(data)
+                except Exception as e:
+                    self._error = e
+        try:
+            self._f.close()
+        except Exception as e:
+            self._error = self._error or e
+
+    def write(self, data: str):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(data)
+
+    def flush(self):
+        # data is compressed in blocks, flushing after every write would hurt
+        # the compression ratio
+        pass
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._queue.put(self._DONE)
+            self._thread.join()
+            if self._error is not None:
+                raise self._error
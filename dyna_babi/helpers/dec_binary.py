@@ -0,0 +1,453 @@
+"""
+Compact binary container for DEC stories (`.decb`).
+
+All strings (entity names, kinds, coref aliases, answers and bAbI sentence
+texts) are interned into a single vocabulary, and each story is stored as a
+flat array of uint16 (or uint32, if needed) values: fixed-width event records
+referencing the vocabulary, with supporting facts stored as bitmasks (when ascending). Stories that don't fit
+the compact layout (e.g. nested question targets) are stored as raw JSON.
+
+File layout::
+
+    MAGIC | story records ... | footer (json: vocabulary, uids, offsets) | footer offset (u64) | MAGIC
+
+The vocabulary is written in a footer so that stories can be streamed to the
+file as they are converted. Records are read from a memory-mapped view of the
+file and decoded to `DECStory` on demand.
+"""
+from typing import Iterator, List
+from pathlib import Path
+from array import array
+import json
+import mmap
+import os
+import struct
+import sys
+
+from .event_calc import DECStory
+from .codec import encode_dec_story, decode_dec_story, dec_story_from_dict
+from .compression import open_text, strip_compression_suffix
+from .stream_writers import PARTIAL_SUFFIX, JsonlWriter
+
+BINARY_DEC_SUFFIX = ".decb"
+MAGIC = b"DECB"
+FORMAT_VERSION = 1
+
+# record types
+RECORD_COMPACT16 = 0 # story stored as uint16 values
+RECORD_COMPACT32 = 1 # story stored as uint32 values
+RECORD_JSON = 2
+COMPACT_TYPECODES = {RECORD_COMPACT16: "H", RECORD_COMPACT32: "I"}
+
+# event flags
+FLAG_COREF = 1
+FLAG_CONJ = 2
+FLAG_Q = 4
+FLAG_ALL_ACT = 8
+FLAG_CHOSEN_Q = 16
+
+# ie_answers value types
+ANS_NONE = 0
+ANS_LIST = 1
+ANS_NESTED = 2
+
+NONE_ID = 0 # vocab id of None values
+MASK_BITS = 16 # bits per supporting facts bitmask word
+UINT16_MAX = 2 ** 16 - 1
+UINT32_MAX = 2 ** 32 - 1
+
+_RECORD_HEADER = struct.Struct("<IBq") # record length (bytes), record type, seed
+_TRAILER = struct.Struct("<Q4s") # footer offset, magic
+
+
+class _NotCompact(Exception):
+    """ Story can't be represented in the compact layout. """
+
+
+def _check_int(i) -> int:
+    if type(i) is not int or not (0 <= i <= UINT32_MAX):
+        raise _NotCompact()
+    return i
+
+
+def _mask_words(idxs: List[int]) -> List[int]:
+    """
+    Encode strictly increasing, non-negative ints as a bitmask, split into 16-bit words.
+    """
+    mask = 0
+    for i in idxs:
+        mask |= 1 << i
+    words = []
+    while mask:
+        words.append(mask & UINT16_MAX)
+        mask >>= MASK_BITS
+    return words
+
+
+def _encode_idxs(out: list, idxs):
+    """
+    Encode list of sentence indices, as a bitmask if possible. Otherwise (if the
+    order isn't ascending, e.g. lists created from sets) as the list of indices.
+    """
+    if not isinstance(idxs, (list, set)):
+        raise _NotCompact()
+    idxs = [_check_int(i) for i in idxs]
+    if all(a < b for a, b in zip(idxs, idxs[1:])):
+        words = _mask_words(idxs)
+        out.append((len(words) << 1) | 1)
+        out.extend(words)
+    else:
+        out.append(len(idxs) << 1)
+        out.extend(idxs)
+
+
+def _mask_idxs(words) -> List[int]:
+    idxs = []
+    for w_i, w in enumerate(words):
+        base = w_i * MASK_BITS
+        while w:
+            low = w & -w
+            idxs.append(base + low.bit_length() - 1)
+            w ^= low
+    return idxs
+
+
+class Vocab:
+    """
+    Interned strings. Id 0 is reserved for None.
+    """
+    def __init__(self, strings: List[str] = None):
+        self.strings = [None] + (list(strings) if strings else [])
+        self.ids = {s: i for i, s in enumerate(self.strings) if s is not None}
+
+    def id(self, s: str) -> int:
+        if s is None:
+            return NONE_ID
+        if type(s) is not str:
+            raise _NotCompact()
+        i = self.ids.get(s)
+        if i is None:
+            i = self.ids[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+    def __getitem__(self, i: int) -> str:
+        return self.strings[i]
+
+    def to_list(self) -> List[str]:
+        return self.strings[1:]
+
+
+def _encode_strs(out: list, vocab: Vocab, strs):
+    if not isinstance(strs, list):
+        raise _NotCompact()
+    out.append(len(strs))
+    out.extend(vocab.id(s) for s in strs)
+
+
+def encode_compact(dec_story: DECStory, vocab: Vocab) -> List[int]:
+    """
+    Encode story (except for its seed and uid, stored in the record header and 
+    footer) as a list of non-negative ints, adding new strings to `vocab`. 
+    Raises `_NotCompact` if the story doesn't fit the compact layout.
+    """
+    out = [vocab.id(dec_story.task)]
+
+    # sentences, without the line number if it matches the position in the story
+    out.append(len(dec_story.babi_story))
+    for i, line in enumerate(dec_story.babi_story):
+        prefix = f"{i+1} "
+        if type(line) is str and line.startswith(prefix):
+            out.append((vocab.id(line[len(prefix):]) << 1) | 1)
+        else:
+            out.append(vocab.id(line) << 1)
+
+    if not isinstance(dec_story.coref_map, dict):
+        raise _NotCompact()
+    out.append(len(dec_story.coref_map))
+    for name, aliases in dec_story.coref_map.items():
+        out.append(vocab.id(name))
+        _encode_strs(out, vocab, aliases)
+
+    out.append(len(dec_story.events))
+    for t_evs in dec_story.events:
+        out.append(len(t_evs))
+        for ev in t_evs:
+            if any(type(f) is not bool for f in [ev.is_coref, ev.is_conj, ev.is_q,
+                                                 ev.is_all_act, ev.chosen_q]):
+                raise _NotCompact()
+            flags = (FLAG_COREF * ev.is_coref) | (FLAG_CONJ * ev.is_conj) | \
+                    (FLAG_Q * ev.is_q) | (FLAG_ALL_ACT * ev.is_all_act) | \
+                    (FLAG_CHOSEN_Q * ev.chosen_q)
+            # fixed-width part of the event record
+            out.extend([_check_int(ev.timestep), vocab.id(ev.kind), flags,
+                        vocab.id(ev.gold_belief), vocab.id(ev.sub_kind)])
+            _encode_strs(out, vocab, ev.source)
+            _encode_strs(out, vocab, ev.target)
+            _encode_strs(out, vocab, ev.ternary)
+            _encode_idxs(out, ev.supporting_facts)
+            if not isinstance(ev.implicit_facts, list):
+                raise _NotCompact()
+            out.append(len(ev.implicit_facts))
+            out.extend(_check_int(i) for i in ev.implicit_facts)
+
+    ie_answers = dec_story.ie_answers
+    if not isinstance(ie_answers, dict):
+        raise _NotCompact()
+    out.append(len(ie_answers))
+    for k, ans in ie_answers.items():
+        out.append(_check_int(k))
+        if ans is None:
+            out.append(ANS_NONE)
+        elif isinstance(ans, list) and ans and all(isinstance(a, list) for a in ans):
+            out.append(ANS_NESTED)
+            out.append(len(ans))
+            for a in ans:
+                _encode_strs(out, vocab, a)
+        else:
+            out.append(ANS_LIST)
+            _encode_strs(out, vocab, ans)
+
+    ie_s_facts = dec_story.ie_s_facts
+    if not isinstance(ie_s_facts, dict):
+        raise _NotCompact()
+    out.append(len(ie_s_facts))
+    for k, alts in ie_s_facts.items():
+        out.append(_check_int(k))
+        if alts is None:
+            out.append(0)
+            continue
+        if not isinstance(alts, list):
+            raise _NotCompact()
+        out.append(len(alts) + 1)
+        for alt in alts:
+            _encode_idxs(out, alt)
+    return out
+
+
+def decode_compact(values: List[int], vocab: Vocab, seed: int, uid: str) -> DECStory:
+    it = iter(values)
+    strings = vocab.strings
+    def take_strs() -> List[str]:
+        return [strings[next(it)] for _ in range(next(it))]
+    def take_idxs() -> List[int]:
+        header = next(it)
+        vals = [next(it) for _ in range(header >> 1)]
+        return _mask_idxs(vals) if header & 1 else vals
+
+    task = strings[next(it)]
+
+    babi_story = []
+    for i in range(next(it)):
+        code = next(it)
+        text = strings[code >> 1]
+        babi_story.append(f"{i+1} {text}" if code & 1 else text)
+
+    coref_map = {}
+    for _ in range(next(it)):
+        name = strings[next(it)]
+        coref_map[name] = take_strs()
+
+    events = []
+    for _ in range(next(it)):
+        t_evs = []
+        for _ in range(next(it)):
+            timestep, kind, flags, gold_belief, sub_kind = next(it), next(it), next(it), next(it), next(it)
+            ev = {
+                "timestep": timestep,
+                "kind": strings[kind],
+                "source": take_strs(),
+                "target": take_strs(),
+                "ternary": take_strs(),
+                "is_coref": bool(flags & FLAG_COREF),
+                "is_conj": bool(flags & FLAG_CONJ),
+                "is_q": bool(flags & FLAG_Q),
+                "is_all_act": bool(flags & FLAG_ALL_ACT),
+                "gold_belief": strings[gold_belief],
+                "supporting_facts": take_idxs(),
+                "implicit_facts": [next(it) for _ in range(next(it))],
+                "chosen_q": bool(flags & FLAG_CHOSEN_Q),
+                "sub_kind": strings[sub_kind]
+                }
+            t_evs.append(ev)
+        events.append(t_evs)
+
+    ie_answers = {}
+    for _ in range(next(it)):
+        k, ans_type = next(it), next(it)
+        if ans_type == ANS_NONE:
+            ie_answers[k] = None
+        elif ans_type == ANS_NESTED:
+            ie_answers[k] = [take_strs() for _ in range(next(it))]
+        else:
+            ie_answers[k] = take_strs()
+
+    ie_s_facts = {}
+    for _ in range(next(it)):
+        k, n_alts = next(it), next(it)
+        ie_s_facts[k] = None if n_alts == 0 else [take_idxs() for _ in range(n_alts - 1)]
+
+    return dec_story_from_dict({
+        "seed": seed,
+        "events": events,
+        "babi_story": babi_story,
+        "coref_map": coref_map,
+        "ie_answers": ie_answers,
+        "ie_s_facts": ie_s_facts,
+        "uid": uid,
+        "task": task
+        })
+
+
+class BinaryDECWriter:
+    """
+    Writes DEC stories to a binary container. Data is written to `<path>.partial`
+    and moved to `path` once `commit()` is called.
+    """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.partial_path = self.path.with_name(self.path.name + PARTIAL_SUFFIX)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = self.partial_path.open("wb")
+        self._f.write(MAGIC)
+        self.vocab = Vocab()
+        self.uids = []
+        self.offsets = []
+
+    @property
+    def closed(self) -> bool:
+        return self._f.closed
+
+    def write_story(self, dec_story: DECStory):
+        try:
+            if type(dec_story.seed) is not int or type(dec_story.uid) is not str:
+                raise _NotCompact()
+            values = encode_compact(dec_story, self.vocab)
+            record_type = RECORD_COMPACT16 if max(values) <= UINT16_MAX else RECORD_COMPACT32
+            values = array(COMPACT_TYPECODES[record_type], values)
+            if sys.byteorder != "little":
+                values.byteswap()
+            payload = values.tobytes()
+        except (_NotCompact, struct.error, OverflowError):
+            record_type, payload = RECORD_JSON, encode_dec_story(dec_story).encode("utf-8")
+        self.uids.append(dec_story.uid)
+        self.offsets.append(self._f.tell())
+        seed = dec_story.seed if record_type != RECORD_JSON else 0
+        self._f.write(_RECORD_HEADER.pack(len(payload), record_type, seed))
+        self._f.write(payload)
+
+    def write_stories(self, dec_stories):
+        for dec_story in dec_stories:
+            self.write_story(dec_story)
+
+    def commit(self):
+        if not self.closed:
+            footer_offset = self._f.tell()
+            footer = {"format_version": FORMAT_VERSION, "vocab": self.vocab.to_list(),
+                      "uids": self.uids, "offsets": self.offsets}
+            self._f.write(json.dumps(footer).encode("utf-8"))
+            self._f.write(_TRAILER.pack(footer_offset, MAGIC))
+            self._f.close()
+            os.replace(self.partial_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self._f.close()
+
+
+class BinaryDECReader:
+    """
+    Memory-mapped reader of binary DEC containers, decoding stories on demand.
+    """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._f = self.path.open("rb")
+        size = os.fstat(self._f.fileno()).st_size
+        if size < len(MAGIC) + _TRAILER.size:
+            self._f.close()
+            raise ValueError(f"{self.path} is not a binary DEC file (empty or truncated)")
+        self._buf = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        footer_offset, magic = _TRAILER.unpack_from(self._buf, len(self._buf) - _TRAILER.size)
+        if self._buf[:len(MAGIC)] != MAGIC or magic != MAGIC:
+            self.close()
+            raise ValueError(f"{self.path} is not a binary DEC file")
+        try:
+            footer_end = len(self._buf) - _TRAILER.size
+            if not len(MAGIC) <= footer_offset <= footer_end:
+                raise ValueError(f"{self.path} has a corrupt footer offset ({footer_offset})")
+            footer = json.loads(self._buf[footer_offset:footer_end])
+            if footer["format_version"] != FORMAT_VERSION:
+                raise ValueError(f"Unsupported binary DEC format version {footer['format_version']} in {self.path}")
+            self.vocab = Vocab(footer["vocab"])
+            self.uids = footer["uids"]
+            self.offsets = footer["offsets"]
+        except Exception:
+            # release the file before raising
+            self.close()
+            raise
+        self._uid_idx = {}
+        self.dup_uids = set()
+        for i, uid in enumerate(self.uids):
+            if uid in self._uid_idx:
+                self.dup_uids.add(uid)
+            self._uid_idx[uid] = i
+
+    def __len__(self) -> int:
+        return len(self.uids)
+
+    def __contains__(self, uid: str) -> bool:
+        return uid in self._uid_idx
+
+    def story(self, i: int) -> DECStory:
+        offset = self.offsets[i]
+        length, record_type, seed = _RECORD_HEADER.unpack_from(self._buf, offset)
+        start = offset + _RECORD_HEADER.size
+        payload = self._buf[start:start+length]
+        if record_type == RECORD_JSON:
+            return decode_dec_story(payload)
+        values = array(COMPACT_TYPECODES[record_type])
+        values.frombytes(payload)
+        if sys.byteorder != "little":
+            values.byteswap()
+        return decode_compact(values.tolist(), self.vocab, seed, self.uids[i])
+
+    def story_by_uid(self, uid: str) -> DECStory:
+        return self.story(self._uid_idx[uid])
+
+    def __iter__(self) -> Iterator[DECStory]:
+        for i in range(len(self.offsets)):
+            yield self.story(i)
+
+    def close(self):
+        self._buf.close()
+        self._f.close()
+
+
+def jsonl_to_binary(dec_file: Path, out_file: Path = None) -> Path:
+    """
+    Convert a (possibly compressed) DEC jsonl file to the binary format.
+    """
+    out_file = Path(out_file) if out_file else \
+        strip_compression_suffix(dec_file).with_suffix(BINARY_DEC_SUFFIX)
+    with open_text(dec_file) as f, BinaryDECWriter(out_file) as writer:
+        for line in f:
+            if line.strip():
+                writer.write_story(decode_dec_story(line))
+    return out_file
+
+
+def binary_to_jsonl(binary_file: Path, out_file: Path = None, compression: str = None) -> Path:
+    """
+    Convert a binary DEC file back to jsonl.
+    """
+    out_file = Path(out_file) if out_file else Path(binary_file).with_suffix(".jsonl")
+    reader = BinaryDECReader(binary_file)
+    with JsonlWriter(out_file, compression=compression) as writer:
+        writer.write_records(encode_dec_story(dec_story) for dec_story in reader)
+    reader.close()
+    return writer.path
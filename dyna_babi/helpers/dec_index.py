@@ -0,0 +1,120 @@
+from typing import Dict, List, Iterator, Tuple
+from pathlib import Path
+from array import array
+import json
+import logging
+import mmap
+import os
+import re
+
+from .compression import path_compression, open_text
+
+INDEX_SUFFIX = ".idx.json" # suffix of sidecar index files
+UID_RE = re.compile(rb'"uid"\s*:\s*"([^"]*)"')
+
+
+def index_path(dec_file: Path) -> Path:
+    dec_file = Path(dec_file)
+    return dec_file.with_name(dec_file.name + INDEX_SUFFIX)
+
+
+class DECFileIndex:
+    """
+    Random access to the stories of a DEC (.jsonl) file by uid.
+
+    An index mapping each uid to the byte offset of its line is built when the
+    file is first opened, and lines are read from a memory-mapped view of the
+    file. If `persist`, the index is written (atomically) to a sidecar file next
+    to the DEC file and reused until the file changes. Compressed files can't be
+    memory-mapped, so they are decompressed into memory and indexed without a
+    sidecar.
+    """
+    def __init__(self, dec_file: Path, persist: bool = True):
+        self.dec_file = Path(dec_file)
+        self.index_file = index_path(self.dec_file)
+        self._f = None
+        if path_compression(self.dec_file):
+            with open_text(self.dec_file) as f:
+                self._buf = f.read().encode("utf-8")
+            self.uids, self.offsets = self._build(self._buf)
+        else:
+            self._f = self.dec_file.open("rb")
+            size = os.fstat(self._f.fileno()).st_size
+            # can't mmap empty files
+            self._buf = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+            self.uids, self.offsets = self._load_or_build(persist)
+        if not self.uids and self._buf[:].strip():
+            self.close()
+            raise ValueError(f"No story uids found in {self.dec_file}, is it a DEC (.jsonl) file?")
+        self._uid_idx = {}
+        self.dup_uids = set()
+        for i, uid in enumerate(self.uids):
+            if uid in self._uid_idx:
+                self.dup_uids.add(uid)
+            self._uid_idx[uid] = i
+
+    def _file_stamp(self) -> Dict:
+        stat = self.dec_file.stat()
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def _load_or_build(self, persist: bool):
+        stamp = self._file_stamp()
+        if self.index_file.exists():
+            try:
+                index = json.loads(self.index_file.read_text())
+                if index["stamp"] == stamp:
+                    return index["uids"], array("q", index["offsets"])
+            except (ValueError, KeyError):
+                pass
+            logging.info(f"Index {self.index_file} out of date, rebuilding...")
+        uids, offsets = self._build(self._buf)
+        if persist:
+            index = {"stamp": stamp, "uids": uids, "offsets": offsets.tolist()}
+            # readers opening the file concurrently each write their own tmp file
+            tmp_file = self.index_file.with_name(f"{self.index_file.name}.{os.getpid()}.tmp")
+            try:
+                tmp_file.write_text(json.dumps(index))
+                os.replace(tmp_file, self.index_file)
+            except OSError as e:
+                logging.warning(f"Couldn't write index file {self.index_file}: {e}")
+                if tmp_file.exists():
+                    tmp_file.unlink()
+        return uids, offsets
+
+    @staticmethod
+    def _build(buf) -> Tuple[List[str], array]:
+        uids, offsets = [], array("q")
+        pos, size = 0, len(buf)
+        while pos < size:
+            end = buf.find(b"\n", pos)
+            end = size if end == -1 else end
+            match = UID_RE.search(buf, pos, end)
+            if match:
+                uids.append(match.group(1).decode("utf-8"))
+                offsets.append(pos)
+            pos = end + 1
+        return uids, offsets
+
+    def __len__(self) -> int:
+        return len(self.uids)
+
+    def __contains__(self, uid: str) -> bool:
+        return uid in self._uid_idx
+
+    def line(self, i: int) -> bytes:
+        start = self.offsets[i]
+        end = self._buf.find(b"\n", start)
+        return self._buf[start:] if end == -1 else self._buf[start:end]
+
+    def line_by_uid(self, uid: str) -> bytes:
+        return self.line(self._uid_idx[uid])
+
+    def lines(self) -> Iterator[bytes]:
+        for i in range(len(self.offsets)):
+            yield self.line(i)
+
+    def close(self):
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+        if self._f:
+            self._f.close()
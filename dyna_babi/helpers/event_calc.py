@@ -1,5 +1,6 @@
-from typing import List, Dict, Optional, Union, Set
+from typing import List, Dict, Optional, Union, Set, Tuple
 
+import copy
 import shortuuid
 import uuid
 from collections import Counter
@@ -7,7 +8,7 @@ from dataclasses import dataclass, asdict, field
 from dataclasses_json import dataclass_json
 from ..helpers.event import Event, QuestionEvent
 from dataclass_type_validator import dataclass_type_validator
-from ..helpers.utils import replace_supp_fact_idx, replace_sent_idx
+from ..helpers.babi_format import BabiLine
         
 # Hacky, replace with automatic version
 ENT_TYPES =  {'bathroom': 'L',
@@ -101,6 +102,19 @@ class DECEvent:
             
         dataclass_type_validator(self)
     
+    def copy(self) -> "DECEvent":
+        """
+        Copy of the event, with copies of its argument lists (cheaper than a
+        `to_dict`/`from_dict` round trip).
+        """
+        ev_copy = copy.copy(self)
+        ev_copy.source = list(self.source)
+        ev_copy.target = [list(t) if isinstance(t, list) else t for t in self.target]
+        ev_copy.ternary = list(self.ternary) if self.ternary else []
+        ev_copy.supporting_facts = sorted(self.supporting_facts)
+        ev_copy.implicit_facts = list(self.implicit_facts) if self.implicit_facts is not None else None
+        return ev_copy
+    
     def to_str(self, names_template: Dict = None) -> str:
         """
         Assuming source and targets are lists of arguments for coref and conj
@@ -479,13 +493,9 @@ def get_q_facts(story: DECStory, q_idx: int) -> List[str]:
     return fact_types
 
 def repl_q_sent_ans_sf(babi_q_sent: str, answer: List[str], supp_facts: List[int]):
-    ans = ",".join(sorted(answer))
-    pre_q = babi_q_sent.split("?")[0].split(" ")[0:] # 
-    pre_q[-1] = pre_q[-1] + "?"
-    q_part = " ".join(pre_q)
-    sf_str = " ".join([str(x) for x in supp_facts])
-    full_sent = f"{q_part}\t{ans}\t{sf_str}\n"
-    return full_sent
+    line = BabiLine.parse(babi_q_sent)
+    q_text = line.text.split("?")[0] + "?"
+    return BabiLine(line.idx, q_text, ",".join(sorted(answer)), list(supp_facts)).to_str()
 
 def check_dec_answers_consistency(story: DECStory):
     """ 
@@ -540,7 +550,7 @@ def check_dec_answers_consistency(story: DECStory):
     
 
 def filter_keep_timesteps(story: DECStory, keep_idxs: List[int],
-            keep_uid: bool = False) -> DECStory:
+            keep_uid: bool = False, return_map: bool = False) -> Union[DECStory, Tuple[DECStory, Dict[int, int]]]:
     """
     Create new DECStory by copying only idxs in `keep_idxs` from `story`.
 
@@ -550,6 +560,8 @@ def filter_keep_timesteps(story: DECStory, keep_idxs: List[int],
         Input DECStory.
     keep_idxs : List[int]
         Sentence idxs to keep.
+    return_map : bool
+        If True, also return the map of kept (old) timesteps to new timesteps.
 
     Returns
     -------
@@ -572,43 +584,29 @@ def filter_keep_timesteps(story: DECStory, keep_idxs: List[int],
 
     
     # renumber sentences if needed
-    for i, timestep_evs in enumerate(evs):
+    for timestep_evs in evs:
         old_t = timestep_evs[0].timestep
-        s = story.babi_story[old_t-1]
+        line = BabiLine.parse(story.babi_story[old_t-1])
         new_t = old_new_map.get(old_t)
         new_timestep_evs = []
+        supports_map = {}
         # renumber event timesteps
         for ev in timestep_evs:
-            ev_copy = DECEvent.from_dict(ev.to_dict())
+            ev_copy = ev.copy()
             ev_copy.timestep = new_t
             
             # renumber q supporting facts idxs
             if ev.is_q:
-                
-                # renumber in babi story
-                for i in ev.supporting_facts:
-                    s = replace_supp_fact_idx(s, i, old_new_map[i])
-                    
-                ev_copy.supporting_facts = [old_new_map[old_t] for old_t in ev.supporting_facts]
+                supports_map.update((t, old_new_map[t]) for t in ev.supporting_facts)
+                ev_copy.supporting_facts = [old_new_map[t] for t in ev.supporting_facts]
                 ie_answers[new_t] = old_ie_answers.get(old_t, None)
                 ie_s_facts[new_t] = old_ie_s_facts.get(old_t)
 
             new_timestep_evs.append(ev_copy)
         
-        # renumber babi sentence
-        # use count = 1 to only replace first occurence (sent. idx)
-        s = replace_sent_idx(s, old_t, new_t)
-        
-        # else:
-        #     new_timestep_evs = timestep_evs
-                    
-            
-            
-            
-            
-        
+        # renumber babi sentence and its supporting facts
         new_evs.append(new_timestep_evs)
-        new_babi_sents.append(s)
+        new_babi_sents.append(line.renumbered(new_t, supports_map).to_str())
     
     if not keep_uid:
         new_dec = DECStory(seed=story.seed,
@@ -627,4 +625,6 @@ def filter_keep_timesteps(story: DECStory, keep_idxs: List[int],
                         ie_s_facts=ie_s_facts,
                         task=story.task,
                         uid=story.uid)
+    if return_map:
+        return new_dec, old_new_map
     return new_dec
@@ -0,0 +1,218 @@
+"""
+Token lengths of transformer inputs, without tokenizing each full input.
+
+A transformer input (see `story_q_to_transformer_q`) is the story sentences
+preceding a question, the `$question$` marker and the question, joined by
+spaces. For tokenizers that split on whitespace before sub-word tokenization
+(e.g., BERT's WordPiece), its length is the sum of the lengths of its parts, so
+each distinct sentence is tokenized once and input lengths are computed with
+cumulative sums over the story.
+
+Lengths can be counted with a Hugging Face tokenizer, or without loading
+`transformers`: with a local WordPiece tokenizer driven by a vocab file (same
+counts as BERT's tokenizer with that vocab), or by splitting on whitespace and
+punctuation.
+"""
+from typing import Dict, Iterable, List
+from pathlib import Path
+import unicodedata
+
+import numpy as np
+
+from .event_calc import DECStory
+from .transformer_preproc import strip_sents
+from .babi_format import BabiLine
+
+QUESTION_MARKER = "$question$"
+TOKENIZER_KINDS = ("hf", "wordpiece", "whitespace")
+DEFAULT_HF_TOKENIZER = "bert-base-uncased"
+
+
+def _is_punctuation(char: str) -> bool:
+    # same definition as BERT's basic tokenizer
+    cp = ord(char)
+    if (33 <= cp <= 47) or (58 <= cp <= 64) or (91 <= cp <= 96) or (123 <= cp <= 126):
+        return True
+    return unicodedata.category(char).startswith("P")
+
+
+class WhitespaceTokenizer:
+    """
+    Splits text on whitespace, and optionally splits punctuation into separate
+    tokens (same as BERT's basic tokenizer, without sub-words).
+    """
+    def __init__(self, split_punctuation: bool = True):
+        self.split_punctuation = split_punctuation
+
+    def _split_punctuation(self, word: str) -> List[str]:
+        tokens, start = [], 0
+        for i, char in enumerate(word):
+            if _is_punctuation(char):
+                if start < i:
+                    tokens.append(word[start:i])
+                tokens.append(char)
+                start = i + 1
+        if start < len(word):
+            tokens.append(word[start:])
+        return tokens
+
+    def tokenize(self, text: str) -> List[str]:
+        words = text.split()
+        if not self.split_punctuation:
+            return words
+        return [token for word in words for token in self._split_punctuation(word)]
+
+
+class WordPieceTokenizer(WhitespaceTokenizer):
+    """
+    Minimal BERT (WordPiece) tokenizer, loaded from a vocab file with one token
+    per line (e.g., the `vocab.txt` of `bert-base-uncased`). Gives the same tokens
+    as `transformers.BertTokenizer` for text without special tokens or Chinese
+    characters.
+    """
+    def __init__(self, vocab_file: Path, lowercase: bool = True, unk_token: str = "[UNK]",
+                 max_chars_per_word: int = 100):
+        super().__init__(split_punctuation=True)
+        with Path(vocab_file).open(encoding="utf-8") as f:
+            self.vocab = {line.rstrip("\n") for line in f}
+        self.do_lower_case = lowercase
+        self.unk_token = unk_token
+        self.max_chars_per_word = max_chars_per_word
+        self._word_cache: Dict[str, List[str]] = {}
+
+    @staticmethod
+    def _clean_text(text: str) -> str:
+        chars = []
+        for char in text:
+            cp = ord(char)
+            if cp == 0 or cp == 0xFFFD or (unicodedata.category(char).startswith("C") 
+                                          and char not in "\t\n\r"):
+                continue
+            chars.append(" " if char.isspace() else char)
+        return "".join(chars)
+
+    def _normalize(self, word: str) -> str:
+        if self.do_lower_case:
+            word = word.lower()
+            word = "".join(c for c in unicodedata.normalize("NFD", word) 
+                           if unicodedata.category(c) != "Mn")
+        return word
+
+    def _wordpiece(self, word: str) -> List[str]:
+        if len(word) > self.max_chars_per_word:
+            return [self.unk_token]
+        pieces, start = [], 0
+        while start < len(word):
+            end = len(word)
+            while start < end:
+                piece = word[start:end] if start == 0 else "##" + word[start:end]
+                if piece in self.vocab:
+                    break
+                end -= 1
+            if start == end:
+                return [self.unk_token]
+            pieces.append(piece)
+            start = end
+        return pieces
+
+    def tokenize(self, text: str) -> List[str]:
+        tokens = []
+        for word in self._clean_text(text).split():
+            for token in self._split_punctuation(self._normalize(word)):
+                if token not in self._word_cache:
+                    self._word_cache[token] = self._wordpiece(token)
+                tokens += self._word_cache[token]
+        return tokens
+
+
+def load_tokenizer(kind: str = "hf", name: str = None):
+    """
+    Load a tokenizer for length counting.
+
+    Parameters
+    ----------
+    kind : str, optional
+        hf (a Hugging Face tokenizer, requires transformers), wordpiece (local
+        WordPiece tokenizer) or whitespace. The default is "hf".
+    name : str, optional
+        Tokenizer name or path for hf (default "bert-base-uncased"), vocab file
+        for wordpiece (required), unused for whitespace.
+    """
+    if kind == "hf":
+        try:
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError("hf tokenizers require transformers, install it with "
+                              "`pip install transformers` or use a wordpiece/whitespace "
+                              "tokenizer.") from e
+        return AutoTokenizer.from_pretrained(name if name else DEFAULT_HF_TOKENIZER)
+    elif kind == "wordpiece":
+        if not name or not Path(name).is_file():
+            raise ValueError(f"The wordpiece tokenizer requires a vocab file, got {name!r}")
+        return WordPieceTokenizer(name)
+    elif kind == "whitespace":
+        return WhitespaceTokenizer()
+    raise ValueError(f"Unsupported tokenizer {kind}, choose one of {list(TOKENIZER_KINDS)}")
+
+
+class LengthOracle:
+    """
+    Caches the token count of each distinct sentence. New sentences are
+    tokenized in batches of `batch_size`.
+    """
+    def __init__(self, tokenizer, batch_size: int = 1024):
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.cache: Dict[str, int] = {}
+
+    def _tokenize_lengths(self, sents: List[str]) -> List[int]:
+        if hasattr(self.tokenizer, "batch_encode_plus"):
+            # huggingface tokenizers, ids map 1:1 to tokens
+            encoded = self.tokenizer.batch_encode_plus(sents, add_special_tokens=False)
+            return [len(ids) for ids in encoded["input_ids"]]
+        return [len(self.tokenizer.tokenize(s)) for s in sents]
+
+    def add_sentences(self, sents: Iterable[str]):
+        """
+        Tokenize and cache all sentences not in the cache yet.
+        """
+        new_sents = list(dict.fromkeys(s for s in sents if s not in self.cache))
+        for i in range(0, len(new_sents), self.batch_size):
+            batch = new_sents[i:i+self.batch_size]
+            self.cache.update(zip(batch, self._tokenize_lengths(batch)))
+
+    def sentence_lengths(self, sents: List[str]) -> List[int]:
+        self.add_sentences(sents)
+        return [self.cache[s] for s in sents]
+
+    @staticmethod
+    def _story_parts(dec_story: DECStory):
+        sents = strip_sents(dec_story)
+        q_idxs = dec_story.question_sent_idxs()
+        questions = [BabiLine.parse(dec_story.babi_story[t-1]).question_answer()[0] for t in q_idxs]
+        return sents, q_idxs, questions
+
+    def add_stories(self, dec_stories: Iterable[DECStory]):
+        """
+        Tokenize and cache the sentences of all stories, in as few batches as possible.
+        """
+        all_sents = [QUESTION_MARKER]
+        for dec_story in dec_stories:
+            sents, _, questions = self._story_parts(dec_story)
+            all_sents += sents + questions
+        self.add_sentences(all_sents)
+
+    def question_lengths(self, dec_story: DECStory) -> List[int]:
+        """
+        Token lengths of the transformer inputs of the story's questions, in the
+        order of `dec_story.question_sent_idxs()`.
+        """
+        sents, q_idxs, questions = self._story_parts(dec_story)
+        self.add_sentences(sents + questions + [QUESTION_MARKER])
+
+        # length of all story sentences (not questions) up to each sentence
+        story_lens = [0 if "?" in s else self.cache[s] for s in sents]
+        prefix_lens = np.concatenate([[0], np.cumsum(story_lens)])
+        marker_len = self.cache[QUESTION_MARKER]
+        return [int(prefix_lens[t-1]) + marker_len + self.cache[q]
+                for t, q in zip(q_idxs, questions)]
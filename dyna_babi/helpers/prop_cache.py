@@ -0,0 +1,82 @@
+"""
+Cache of the proposition vocabulary of worlds (all propositions that can hold
+between their entities, see `world.create_prop_maps`).
+
+The vocabulary only depends on the entities defined by the game variables
+(names and kinds of persons, locations and objects), so it is cached in memory
+and on disk, keyed by a hash of the entities. The cache dir is set with the
+`DYNA_BABI_CACHE_DIR` environment variable (default: ~/.cache/dyna_babi), and
+setting it to an empty string disables the disk cache.
+"""
+from typing import Callable, Dict, Iterable, List, Optional
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+CACHE_DIR_ENV = "DYNA_BABI_CACHE_DIR"
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "dyna_babi"
+PROP_CACHE_VERSION = 1 # change if the propositions of entity pairs change
+
+_props_cache: Dict[str, List[str]] = {}
+
+
+def cache_dir() -> Optional[Path]:
+    value = os.environ.get(CACHE_DIR_ENV)
+    if value is None:
+        return DEFAULT_CACHE_DIR
+    return Path(value) if value else None
+
+
+def vocab_key(entities: Iterable) -> str:
+    """
+    Hash of the names and kinds of `entities`.
+    """
+    vocab = sorted({(e.kind, e.name) for e in entities})
+    data = json.dumps([PROP_CACHE_VERSION, vocab])
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def _read_props(path: Path) -> Optional[List[str]]:
+    try:
+        with path.open(encoding="utf-8") as f:
+            props = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return props if isinstance(props, list) else None
+
+
+def _write_props(path: Path, props: List[str]):
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temp file first, other processes may be reading the same file
+        with tempfile.NamedTemporaryFile("w", dir=path.parent, prefix=f".{path.name}.",
+                                         delete=False, encoding="utf-8") as f:
+            json.dump(props, f)
+        os.replace(f.name, path)
+    except OSError as e:
+        logging.warning(f"Couldn't write proposition cache {path}: {e}")
+
+
+def cached_props(entities: Iterable, create_props: Callable[[], List[str]]) -> List[str]:
+    """
+    Sorted propositions of `entities`, from the memory or disk cache if
+    available, created with `create_props` otherwise.
+    """
+    entities = list(entities)
+    key = vocab_key(entities)
+    if key in _props_cache:
+        return _props_cache[key]
+
+    directory = cache_dir()
+    path = directory / f"props_{key}.json" if directory else None
+    props = _read_props(path) if path else None
+    if props is None:
+        props = create_props()
+        if path:
+            _write_props(path, props)
+
+    _props_cache[key] = props
+    return props
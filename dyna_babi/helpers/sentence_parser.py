@@ -0,0 +1,168 @@
+"""
+Parser of bAbI story lines, used by the solver to replay stories.
+
+The vocabularies of the story parameters and game variables (action synonyms,
+pronouns, person names, negations) and the fixed question keywords are compiled
+once into a token trie, so each line is tokenized and scanned once, at a cost
+independent of the vocabulary size.
+"""
+from typing import List, Optional, Set, Tuple, Union
+from dataclasses import dataclass
+import re
+
+from ..game_variables_parser import StoryParameters, GameVariables
+from .babi_format import BabiLine
+
+TOKEN_RE = re.compile(r"[\w']+")
+
+# fixed keywords of question and action sentences
+KEYWORDS = ["was", "Where", "is the", "How many", "carrying", "Is", "gave", "to",
+            "received", "Who", "What", "give", "they", "either", "is"]
+
+_LABELS = None # key of labels in trie nodes
+
+
+@dataclass
+class ParsedLine:
+    """
+    A parsed bAbI line. `kind` is the kind of the action or question (None if
+    the line wasn't recognized), and `args` are the names of its entities, in
+    the order expected by `act_specific`/`ask_specific`.
+    """
+    kind: Optional[str]
+    is_q: bool = False
+    args: Tuple[str, ...] = ()
+    coref: bool = False
+    sub_kind: Optional[str] = None # giving question kind, or negation of a negate action
+    answer: Optional[str] = None
+
+
+def _strip_words(words: List[str], first: str, second: str) -> List[str]:
+    # remove `first`, and then `second` only if `first` was found
+    words = list(words)
+    if first in words:
+        words.remove(first)
+        if second in words:
+            words.remove(second)
+    return words
+
+
+class SentenceParser:
+    """
+    Parses lines of bAbI stories into `ParsedLine`s, for the vocabulary of the
+    given story parameters and game variables.
+    """
+    def __init__(self, params: StoryParameters, game_vars: GameVariables):
+        self.game_vars = game_vars
+        self.negations = list(params.negate)
+        self.trie = {}
+        for kind in ["move", "grab", "drop", "give"]:
+            for synonym in getattr(params, kind):
+                self._add(synonym, ("action", kind))
+        for neg in params.negate:
+            self._add(neg, ("negate", neg))
+        for values in params.entity_coreference_map.values():
+            self._add(values[0], ("coref", values[0]))
+        for person in game_vars.persons:
+            self._add(person, ("person", person))
+        for keyword in KEYWORDS:
+            self._add(keyword, ("keyword", keyword))
+
+    def _add(self, phrase: str, label: Tuple[str, str]):
+        node = self.trie
+        for token in TOKEN_RE.findall(phrase):
+            node = node.setdefault(token, {})
+        node.setdefault(_LABELS, set()).add(label)
+
+    def scan(self, words: List[str]) -> Set[Tuple[str, str]]:
+        """
+        Return labels of all vocabulary phrases found in `words`.
+        """
+        found = set()
+        for i in range(len(words)):
+            node = self.trie
+            for token in words[i:]:
+                node = node.get(token)
+                if node is None:
+                    break
+                if _LABELS in node:
+                    found.update(node[_LABELS])
+        return found
+
+    def parse(self, line: Union[str, BabiLine]) -> ParsedLine:
+        if isinstance(line, BabiLine):
+            # same words as the raw line, from its already split fields
+            words = [str(line.idx)] + TOKEN_RE.findall(line.text)
+            if line.is_question:
+                words += TOKEN_RE.findall(line.answer) + [str(s) for s in line.supports]
+            is_q = line.is_question
+        else:
+            words = TOKEN_RE.findall(line)
+            is_q = '\t' in line
+        found = self.scan(words)
+        if is_q:
+            return self._parse_question(words, found)
+        return self._parse_action(words, found)
+
+    @staticmethod
+    def _parse_question(words: List[str], found: Set) -> ParsedLine:
+        def has(*keywords) -> bool:
+            return all(("keyword", k) in found for k in keywords)
+
+        if has("was"):
+            return ParsedLine("where_was_object", True, (words[4], words[7]), answer=words[8])
+        elif has("Where", "is the"):
+            return ParsedLine("where_object", True, (words[4],), answer=words[5])
+        elif has("Where"):
+            return ParsedLine("where_person", True, (words[3],), answer=words[4])
+        elif has("How many"):
+            return ParsedLine("counting", True, (words[5],), answer=words[7])
+        elif has("carrying"):
+            answers = sorted([word for i, word in enumerate(words) if (i > 4) and word.isalpha()])
+            return ParsedLine("list", True, (words[3],), answer=",".join(answers))
+        elif has("Is"):
+            return ParsedLine("yes_no", True, (words[2], words[5]), answer=words[6])
+        # giving questions, args are (person1, person2, object)
+        elif has("gave", "to"):
+            return ParsedLine("giving", True, (None, words[6], words[4]),
+                              sub_kind="gave_to", answer=words[7])
+        elif has("gave"):
+            return ParsedLine("giving", True, (None, None, words[4]), sub_kind="gave", answer=words[5])
+        elif has("received"):
+            return ParsedLine("giving", True, (None, None, words[4]),
+                              sub_kind="received", answer=words[5])
+        elif has("Who", "give"):
+            return ParsedLine("giving", True, (words[3], None, words[6]),
+                              sub_kind="who_give", answer=words[8])
+        elif has("What", "give"):
+            return ParsedLine("giving", True, (words[3], words[6], None),
+                              sub_kind="what_give", answer=words[7])
+        return ParsedLine(None, True)
+
+    def _parse_action(self, words: List[str], found: Set) -> ParsedLine:
+        kinds = {label for group, label in found if group == "action"}
+        is_coref = any(group == "coref" for group, _ in found)
+        if "move" in kinds:
+            if is_coref:
+                return ParsedLine("move", args=(words[-1],), coref=True)
+            elif ("keyword", "they") in found:
+                # compound
+                return ParsedLine("conj", args=(words[-1],), coref=True)
+            elif len([1 for group, _ in found if group == "person"]) > 1:
+                return ParsedLine("conj", args=(words[1], words[3], words[-1]))
+            return ParsedLine("move", args=(words[1], words[-1]))
+        elif "grab" in kinds or "drop" in kinds:
+            kind = "grab" if "grab" in kinds else "drop"
+            words = _strip_words(words, "there", "up" if kind == "grab" else "down")
+            if is_coref:
+                return ParsedLine(kind, args=(words[-1],), coref=True)
+            return ParsedLine(kind, args=(words[1], words[-1]))
+        elif "give" in kinds:
+            return ParsedLine("give", args=(words[1], words[6], words[4]))
+        elif ("keyword", "either") in found:
+            return ParsedLine("indef", args=(words[1], words[6], words[9]))
+        elif ("keyword", "is") in found:
+            negations = {label for group, label in found if group == "negate"}
+            negate = next((neg for neg in self.negations if neg in negations), "")
+            return ParsedLine("negate", args=(words[1], words[-1]), sub_kind=negate)
+        return ParsedLine(None)
@@ -0,0 +1,75 @@
+from typing import Iterator, List
+from pathlib import Path
+from array import array
+import shutil
+import tempfile
+import weakref
+
+from .event_calc import DECStory
+from .codec import encode_dec_story, decode_dec_story
+
+
+class SpilledStoryStore:
+    """
+    Append-only on-disk store of DECStory objects.
+
+    Stories are serialized to a JSONL file as they are added, and only a small
+    index (uid -> byte offset, and story seeds) is kept in memory, so memory
+    use doesn't grow with the size of the stored stories. Stories are decoded
+    again when iterated over or looked up by uid.
+    """
+    def __init__(self, spill_dir: str = None, name: str = "stories"):
+        if spill_dir:
+            Path(spill_dir).mkdir(parents=True, exist_ok=True)
+        self._tmp_dir = tempfile.mkdtemp(prefix="dyna_babi_spill_", dir=spill_dir)
+        self.path = Path(self._tmp_dir) / f"{name}.jsonl"
+        self._f = self.path.open("a+b")
+        self._offsets = array("q")
+        self._uid_idx = {}
+        self.seeds = array("q")
+        # remove spill files once the store is no longer referenced
+        self._finalizer = weakref.finalize(self, _remove_spill, self._f, self._tmp_dir)
+
+    def append(self, dec_story: DECStory):
+        self._f.seek(0, 2)
+        self._uid_idx[dec_story.uid] = len(self._offsets)
+        self._offsets.append(self._f.tell())
+        self.seeds.append(dec_story.seed)
+        self._f.write(encode_dec_story(dec_story).encode("utf-8") + b"\n")
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __contains__(self, uid: str) -> bool:
+        return uid in self._uid_idx
+
+    def __iter__(self) -> Iterator[DECStory]:
+        self._f.flush()
+        with self.path.open("rb") as f:
+            for line in f:
+                yield decode_dec_story(line)
+
+    def uids(self) -> List[str]:
+        """
+        Return uids of all stored stories, in insertion order.
+        """
+        return list(self._uid_idx.keys())
+
+    def keys(self) -> List[str]:
+        return self.uids()
+
+    def get(self, uid: str) -> DECStory:
+        self._f.flush()
+        self._f.seek(self._offsets[self._uid_idx[uid]])
+        return decode_dec_story(self._f.readline())
+
+    def __getitem__(self, uid: str) -> DECStory:
+        return self.get(uid)
+
+    def close(self):
+        self._finalizer()
+
+
+def _remove_spill(f, tmp_dir: str):
+    f.close()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -2,6 +2,7 @@ from typing import Dict, List, Tuple
 
 
 import numpy as np
+from bisect import bisect_right
 from collections import defaultdict
 
 from ..utils import choice_np_rng
@@ -30,12 +31,26 @@ def get_props_belief_timeline(diff_props: Dict[int, List[ProbProposition]]) -> D
     for t, pprops in sorted(diff_props.items(), key=lambda x: x[0]):
         for p in pprops:
             props_timeline[p.realization].append((t, p.belief))
-            
-            # TODO change this to use set
-            props_timeline[p.realization] = sorted(list(set(props_timeline[p.realization])), key=lambda x: x[0])
+    
+    for prop, timeline in props_timeline.items():
+        props_timeline[prop] = _dedup_timeline(timeline)
     
     return props_timeline
 
+def _dedup_timeline(timeline: List[Tuple[int, float]]) -> List[Tuple[int, float]]:
+    # changes are appended in chrono. order, so unless different beliefs share a
+    # timestep, removing duplicates keeps the timeline sorted
+    unique = list(dict.fromkeys(timeline))
+    if len(set(t for t, _ in unique)) == len(unique):
+        return unique
+    
+    # order of beliefs at the same timestep follows the set order of
+    # re-sorting after each change, keep it as is
+    deduped = []
+    for change in timeline:
+        deduped = sorted(list(set(deduped + [change])), key=lambda x: x[0])
+    return deduped
+
 def get_obj_belief_timeline(obj_name: str, diff_props: Dict[int, List[ProbProposition]]) -> List[Tuple[int, ProbProposition]]:
     """
     
@@ -80,15 +95,12 @@ def prop_belief_at_t(prop: str, at_t: int, props_timeline: Dict[str, List[Tuple[
         # assuming known props (not those that haven't been mentioned)
         assert(prop in props_timeline)
         
-        prob = UNKNOWN_PROB
-        event_t = UNKNOWN_PROB
-        for t, p in props_timeline[prop]:
-            # take last known belief up until target t
-            if t <= at_t:
-                prob = p
-                event_t = t
-            else:
-                break
+        # take last known belief up until target t (timeline is sorted by time)
+        timeline = props_timeline[prop]
+        i = bisect_right(timeline, (at_t, float("inf")))
+        if i == 0:
+            return UNKNOWN_PROB, UNKNOWN_PROB
+        event_t, prob = timeline[i-1]
         return prob, event_t
         
 def props_by_belief_time(at_t: int,
@@ -120,10 +132,122 @@ def props_by_belief_time(at_t: int,
     return target_props
         
         
+class BeliefIndex:
+    """
+    Belief timelines of all propositions of a story, with sorted change times per
+    proposition for bisect lookups. Built once per story and shared by the
+    `BeliefBase`s of all its questions; the propositions by belief at each
+    timestep are cached, so they're only collected once per story.
+    """
+    def __init__(self, diff_props: Dict[int, List[ProbProposition]]):
+        self.props_timeline = get_props_belief_timeline(diff_props)
+        self.times = {p: [t for t, _ in timeline] for p, timeline in self.props_timeline.items()}
+        self._by_belief = {}
+    
+    def belief_at(self, prop: str, at_t: int) -> Tuple[float, int]:
+        """
+        Last known belief of `prop` up until `at_t`, and the time it was set.
+        """
+        i = bisect_right(self.times[prop], at_t)
+        if i == 0:
+            return UNKNOWN_PROB, UNKNOWN_PROB
+        event_t, prob = self.props_timeline[prop][i-1]
+        return prob, event_t
+    
+    def props_by_belief(self, at_t: int) -> Tuple[List, List]:
+        """
+        Sorted lists of (prop, belief, time) of the negative (belief 0) and
+        positive propositions at `at_t`.
+        """
+        if at_t not in self._by_belief:
+            negs, pos = [], []
+            for p in self.props_timeline.keys():
+                bel, t = self.belief_at(p, at_t)
+                if bel == 0.0:
+                    negs.append((p, bel, t))
+                elif bel > 0.0:
+                    pos.append((p, bel, t))
+            self._by_belief[at_t] = (sorted(negs), sorted(pos))
+        return self._by_belief[at_t]
+        
+        
+class BeliefMatrix(BeliefIndex):
+    """
+    Beliefs of all propositions at each timestep of a story, as a dense
+    (timestep x proposition) matrix of forward-filled beliefs (`UNKNOWN_PROB`
+    before a proposition is first mentioned), and the matching matrix of the
+    times they were set. Row 0 is the state before the story starts.
+    
+    Columns follow `prop2idx` (propositions missing from it are added after its
+    columns), so the matrix can be exported as is as supervision for all the
+    propositions of the world.
+    """
+    def __init__(self, diff_props: Dict[int, List[ProbProposition]], prop2idx: Dict[str, int] = None,
+                 n_timesteps: int = 0):
+        super().__init__(diff_props)
+        prop2idx = dict(prop2idx) if prop2idx else {}
+        for p in sorted(self.props_timeline.keys()):
+            prop2idx.setdefault(p, len(prop2idx))
+        self.prop2idx = prop2idx
+        self.props = np.array(sorted(prop2idx, key=prop2idx.get))
+        
+        change_ts = [t for timeline in self.props_timeline.values() for t, _ in timeline]
+        self.n_timesteps = max([n_timesteps] + change_ts)
+        
+        # set beliefs at change times (later changes at the same time win, as in
+        # `belief_at`) and forward fill them
+        changes = np.full((self.n_timesteps + 1, len(prop2idx)), np.nan)
+        for p, timeline in self.props_timeline.items():
+            for t, belief in timeline:
+                changes[t, prop2idx[p]] = belief
+        rows = np.where(np.isnan(changes), 0, np.arange(self.n_timesteps + 1)[:, None])
+        self.change_times = np.maximum.accumulate(rows, axis=0)
+        self.beliefs = changes[self.change_times, np.arange(len(prop2idx))]
+        self.beliefs[self.change_times == 0] = UNKNOWN_PROB
+        
+        # columns in sorted proposition order
+        self._sorted_cols = np.argsort(self.props, kind="stable")
+        self._cols_by_belief = {}
+    
+    def _row(self, at_t: int) -> int:
+        # beliefs don't change after the last change
+        return min(at_t, self.n_timesteps)
+    
+    def cols_by_belief(self, at_t: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Columns of the negative (belief 0) and positive propositions at `at_t`,
+        sorted by proposition.
+        """
+        row_idx = self._row(at_t)
+        if row_idx not in self._cols_by_belief:
+            row = self.beliefs[row_idx, self._sorted_cols]
+            self._cols_by_belief[row_idx] = (self._sorted_cols[row == 0.0], self._sorted_cols[row > 0.0])
+        return self._cols_by_belief[row_idx]
+    
+    def prop_at(self, col: int, at_t: int) -> Tuple[str, float, int]:
+        """
+        (prop, belief, time) of the proposition of column `col` at `at_t`.
+        """
+        row = self._row(at_t)
+        return (str(self.props[col]), float(self.beliefs[row, col]), int(self.change_times[row, col]))
+    
+    def props_by_belief(self, at_t: int) -> Tuple[List, List]:
+        negs, pos = self.cols_by_belief(at_t)
+        return [self.prop_at(c, at_t) for c in negs], [self.prop_at(c, at_t) for c in pos]
+    
+    def timestep_beliefs(self) -> np.ndarray:
+        """
+        Beliefs at timesteps 1..n, as float32 (n_timesteps x n_props).
+        """
+        return self.beliefs[1:].astype(np.float32)
+
+
 class BeliefBase:
-    def __init__(self, diff_props: Dict[int, List[ProbProposition]], seed: int = None):
+    def __init__(self, diff_props: Dict[int, List[ProbProposition]], seed: int = None,
+                 belief_matrix: BeliefMatrix = None):
         self.diff_props = diff_props
-        self.props_timeline = get_props_belief_timeline(diff_props)
+        self.belief_matrix = belief_matrix if belief_matrix else BeliefMatrix(diff_props)
+        self.props_timeline = self.belief_matrix.props_timeline
         
         # if random seed not provided, sample one at random
         if not seed:
@@ -189,13 +313,10 @@ class BeliefBase:
         """
         if k == 0:
             return []
-        belief_f = lambda x: x == 0.0
-        all_negs = props_by_belief_time(at_t=at_t, 
-                                        props_timeline=self.props_timeline,
-                                        belief_cond_f=belief_f)
-        eff_k = min(len(all_negs), k)
-        chosen_idxs = self.samples_rng.choice(len(all_negs), eff_k, replace=False)
-        return [p for i, p in enumerate(sorted(all_negs)) if i in chosen_idxs]
+        neg_cols, _ = self.belief_matrix.cols_by_belief(at_t)
+        eff_k = min(len(neg_cols), k)
+        chosen_idxs = np.sort(self.samples_rng.choice(len(neg_cols), eff_k, replace=False))
+        return [self.belief_matrix.prop_at(c, at_t) for c in neg_cols[chosen_idxs]]
     
     def sample_pos(self, at_t: int, k: int) -> List[ProbProposition]:
         """
@@ -216,13 +337,10 @@ class BeliefBase:
         """
         if k == 0:
             return []
-        belief_f = lambda x: x > 0.0
-        all_pos = props_by_belief_time(at_t=at_t, 
-                                        props_timeline=self.props_timeline,
-                                        belief_cond_f=belief_f)
-        eff_k = min(len(all_pos), k)
-        chosen_idxs = self.samples_rng.choice(len(all_pos), eff_k, replace=False)
-        return [p for i, p in enumerate(sorted(all_pos)) if i in chosen_idxs]
+        _, pos_cols = self.belief_matrix.cols_by_belief(at_t)
+        eff_k = min(len(pos_cols), k)
+        chosen_idxs = np.sort(self.samples_rng.choice(len(pos_cols), eff_k, replace=False))
+        return [self.belief_matrix.prop_at(c, at_t) for c in pos_cols[chosen_idxs]]
     
     
                 
@@ -5,17 +5,18 @@ Created on Thu Jul  8 10:53:35 2021
 
 @author: ronent
 """
-from typing import List, Tuple, Dict, Optional
+from typing import List, Tuple, Dict, Optional, Iterator
 from dataclasses_json import dataclass_json
 from dataclasses import dataclass, field
 
 from ...Questions.Question import QuestionType
-from ...helpers.transformer_preproc import dec_story_to_transformer_inputs, TransformerInstance
+from ...helpers.transformer_preproc import TransformerInstance
 from ...world import World
 from ..event_calc import DECStory, DECEvent, from_world_event
-from ..transformer_preproc import strip_sents, process_question_sent
+from ..transformer_preproc import strip_sents, process_line, story_text_prefixes
+from ..babi_format import BabiLine
 from .proposition import ProbProposition
-from .belief_base import BeliefBase, get_obj_belief_timeline
+from .belief_base import BeliefBase, BeliefMatrix, get_obj_belief_timeline
 
 import shortuuid
 
@@ -78,7 +79,8 @@ class SSTSampleOptions:
 
 def create_target_prop_list(texts: List[str], until_t: int, seed: int,  world: World, diff_props: bool = True,
                             n_sample_pos: int = 2, n_sample_neg: int = 2, max_per_t: int = 5,
-                            verbose_props: bool = False) -> List[List[Tuple[int, float]]]:
+                            verbose_props: bool = False, 
+                            belief_matrix: BeliefMatrix = None) -> List[List[Tuple[int, float]]]:
     """
     
 
@@ -88,6 +90,8 @@ def create_target_prop_list(texts: List[str], until_t: int, seed: int,  world: W
         DESCRIPTION.
     prop_lists : Dict
         DESCRIPTION.
+    belief_matrix : BeliefMatrix, optional
+        Beliefs of the story, built from `world.diff_props` if not provided.
 
     Returns
     -------
@@ -95,7 +99,9 @@ def create_target_prop_list(texts: List[str], until_t: int, seed: int,  world: W
         DESCRIPTION.
 
     """
-    beliefs = BeliefBase(world.diff_props, seed=seed)
+    if belief_matrix is None:
+        belief_matrix = BeliefMatrix(world.diff_props, world.prop2idx)
+    beliefs = BeliefBase(world.diff_props, seed=seed, belief_matrix=belief_matrix)
     target_prop_dict = beliefs.sample_props(until_t-1, diff_props=diff_props,
                                             n_sample_pos=n_sample_pos, n_sample_neg=n_sample_neg,
                                             max_per_t=max_per_t)
@@ -126,6 +132,7 @@ def dec_to_sst_insts(dec_story: DECStory, world: World, sst_opts: SSTSampleOptio
         DESCRIPTION.
 
     """
+    assert world.track_props, "SST instances require a world tracking propositions (see `World.track_props`)"
     sst_opts = sst_opts if sst_opts else SSTSampleOptions()
     
     sst_insts = []
@@ -133,6 +140,9 @@ def dec_to_sst_insts(dec_story: DECStory, world: World, sst_opts: SSTSampleOptio
     
     # to account for question idxs getting dropped
     correction_map = {t: i for i,t in enumerate(dec_story.story_sent_idxs())}
+    
+    # shared by all questions of the story
+    belief_matrix = BeliefMatrix(world.diff_props, world.prop2idx)
 
     for q_timestep in dec_story.question_sent_idxs():
         q_idx = q_timestep - 1
@@ -145,9 +155,10 @@ def dec_to_sst_insts(dec_story: DECStory, world: World, sst_opts: SSTSampleOptio
         
         story_lines = [line for line in stripped_lines[:q_idx] if not "?" in line]
         
-        question, answer = process_question_sent(stripped_lines[q_idx])
+        question, answer = BabiLine.parse(dec_story.babi_story[q_idx]).question_answer()
         
-        target_prop_list = create_target_prop_list(story_lines, q_timestep, seed=seed, world=world, **sst_opts.to_dict())
+        target_prop_list = create_target_prop_list(story_lines, q_timestep, seed=seed, world=world, 
+                                                   belief_matrix=belief_matrix, **sst_opts.to_dict())
         
         # unpack to list of props and list of outputs
         unpacked = [list(zip(*pairs)) for pairs in target_prop_list]
@@ -271,6 +282,7 @@ def dec_to_sst_qa_insts(dec_story: DECStory, world: World, sst_opts: SSTSampleOp
         DESCRIPTION.
 
     """
+    assert world.track_props, "SST instances require a world tracking propositions (see `World.track_props`)"
     sst_opts = sst_opts if sst_opts else SSTSampleOptions()
     sst_insts = []
     stripped_lines = strip_sents(dec_story)
@@ -291,7 +303,7 @@ def dec_to_sst_qa_insts(dec_story: DECStory, world: World, sst_opts: SSTSampleOp
         
         story_lines = [line for line in stripped_lines[:q_idx] if not "?" in line]
         
-        question, answer = process_question_sent(stripped_lines[q_idx])
+        question, answer = BabiLine.parse(dec_story.babi_story[q_idx]).question_answer()
         
         source = q_ev.source[0] # person or object name
         target = q_ev.target[0] # location name
@@ -404,7 +416,124 @@ def convert_props_to_questions(world, props, outs, verbose_props: bool = True, s
     
     
     
-def decs_from_sst(sst: InstanceSST, world: World) -> List[DECStory]:
+def numbered_world_events(world: World) -> List[List[DECEvent]]:
+    """
+    Events of the world's story in DEC format, numbered by timestep. Can be
+    shared by the SST instances of the same story.
+    """
+    all_events = sorted([from_world_event(e) for e in world.history.values()], key=lambda x: x[0].timestep)
+    return number_events(all_events)
+
+
+class SSTStories:
+    """
+    Per-timestep stories of an SST instance (see `decs_from_sst`), as
+    created by `sst_story_views`. The story
+    sentences, their joined text and the numbered world events are shared by all
+    timesteps, and each timestep's story is a `SSTStoryView` over them.
+    """
+    def __init__(self, sst: InstanceSST, world: World, events: List[List[DECEvent]] = None):
+        self.sst = sst
+        self.world = world
+        self.events = events if events is not None else numbered_world_events(world)
+        
+        # sentences as stripped from numbered lines, joined once for all transformer inputs
+        self.sents = [process_line(f"1 {sent}") for sent in sst.texts]
+        self.text, self.prefix_ends = story_text_prefixes(self.sents)
+        
+        self._views = [SSTStoryView(self, i+1) for i in 
+                       range(min(len(sst.texts), len(sst.prop_lists), len(sst.outputs)))]
+    
+    def __len__(self) -> int:
+        return len(self._views)
+    
+    def __getitem__(self, i: int) -> "SSTStoryView":
+        return self._views[i]
+    
+    def __iter__(self) -> Iterator["SSTStoryView"]:
+        return iter(self._views)
+
+
+class SSTStoryView:
+    """
+    Story of timestep `t` of an SST instance: its sentences up to `t`, followed
+    by yes/no questions of the timestep's propositions. The question sentences
+    and events are only created when accessed, and a `DECStory` only by
+    `to_dec_story()`.
+    """
+    def __init__(self, stories: SSTStories, t: int):
+        self.stories = stories
+        self.t = t
+        self.seed = stories.sst.seed
+        self.task = stories.sst.task
+        self.uid = f"{stories.sst.uid}_{shortuuid.ShortUUID().random(length=6)}"
+        self._questions = None
+    
+    @property
+    def questions(self) -> Tuple[List[str], List[DECEvent]]:
+        if self._questions is None:
+            sst = self.stories.sst
+            self._questions = convert_props_to_questions(self.stories.world, sst.prop_lists[self.t-1],
+                                                         sst.outputs[self.t-1], start_t=self.t+1)
+        return self._questions
+    
+    @property
+    def babi_story(self) -> List[str]:
+        question_texts, _ = self.questions
+        return number_sents(self.stories.sst.texts[:self.t] + question_texts)
+    
+    @property
+    def events(self) -> List[List[DECEvent]]:
+        _, q_events = self.questions
+        return self.stories.events[:self.t] + [[q] for q in q_events]
+    
+    def to_dec_story(self) -> DECStory:
+        return DECStory(seed=self.seed, uid=self.uid, babi_story=self.babi_story, 
+                        events=self.events, task=self.task)
+    
+    def transformer_instances(self) -> Iterator[TransformerInstance]:
+        """
+        Same instances as `dec_story_to_transformer_inputs(self.to_dec_story())`
+        (with the question index appended to ids), built from the shared story text.
+        """
+        question_texts, q_events = self.questions
+        story_text = self.stories.text[:self.stories.prefix_ends[self.t]]
+        for i, (q_text, q_ev) in enumerate(zip(question_texts, q_events)):
+            q_timestep = self.t + 1 + i
+            question, answer = BabiLine.parse(f"{q_timestep} {q_text}").question_answer()
+            ti = TransformerInstance(id=self.uid,
+                                     task=self.task,
+                                     seed=self.seed,
+                                     q_sub_id=q_timestep,
+                                     input="%s $question$ %s" % (story_text, question),
+                                     output=answer,
+                                     supporting_facts=q_ev.supporting_facts,
+                                     chosen_q=q_ev.chosen_q)
+            ti.id = f"{ti.id}_{i}"
+            yield ti
+
+
+def sst_story_views(sst: InstanceSST, world: World, events: List[List[DECEvent]] = None) -> SSTStories:
+    """
+    Per-timestep stories of an SST instance (same as `decs_from_sst`), as views
+    over the instance's shared sentences and events.
+
+    Parameters
+    ----------
+    sst : InstanceSST
+        DESCRIPTION.
+    events : List[List[DECEvent]], optional
+        Events of the world's story (see `numbered_world_events`), created if not provided.
+
+    Returns
+    -------
+    SSTStories
+        Sequence of `SSTStoryView`s, one per timestep.
+
+    """
+    return SSTStories(sst, world, events=events)
+
+def decs_from_sst(sst: InstanceSST, world: World, events: List[List[DECEvent]] = None) -> List[DECStory]:
     """
     Convert an SST instance to a list of bAbI stories. To limit story size
     we split it into one story for each timestep, where each of the timestep's 
@@ -414,6 +543,8 @@ def decs_from_sst(sst: InstanceSST, world: World) -> List[DECStory]:
     ----------
     sst : InstanceSST
         DESCRIPTION.
+    events : List[List[DECEvent]], optional
+        Events of the world's story (see `numbered_world_events`), created if not provided.
 
     Returns
     -------
@@ -421,36 +552,19 @@ def decs_from_sst(sst: InstanceSST, world: World) -> List[DECStory]:
         DESCRIPTION.
 
     """    
-    
-    babi_stories = []
-    cum_sents = []
-    
-    all_events = sorted([from_world_event(e) for e in world.history.values()], key=lambda x: x[0].timestep)
-    # if not len(all_events) == len(sst.texts):
-        # print("problem")
-    # assert(len(all_events) == len(sst.texts))
-    
-    numbered_evs = number_events(all_events)
-    
-    for i, (sent, props, outs) in enumerate(zip(sst.texts, sst.prop_lists, 
-                                           sst.outputs)):
-        t = i+1
-        cum_sents.append(sent)
-        question_texts, q_events = convert_props_to_questions(world, props, outs, start_t=t+1)
-        
-        episode = number_sents(cum_sents + question_texts)
-        
-        events = numbered_evs[:t] + [[q] for q in q_events]
-        
-        new_story_uid = shortuuid.ShortUUID().random(length=6)
- 
-        new_story = DECStory(seed=sst.seed, uid=f"{sst.uid}_{new_story_uid}",
-                             babi_story=episode, events=events, task=sst.task)
-        babi_stories.append(new_story)
-    
-    return babi_stories
+    return [view.to_dec_story() for view in sst_story_views(sst, world, events=events)]
+
+def iter_transformer_insts_from_sst(sst: InstanceSST, world: World, 
+                                    events: List[List[DECEvent]] = None) -> Iterator[TransformerInstance]:
+    """
+    Iterate over the TransformerInstances of all per-timestep stories of `sst`,
+    without creating the stories.
+    """
+    for view in sst_story_views(sst, world, events=events):
+        yield from view.transformer_instances()
 
-def transformer_insts_from_sst(sst: InstanceSST, world: World) -> List[TransformerInstance]:
+def transformer_insts_from_sst(sst: InstanceSST, world: World, 
+                               events: List[List[DECEvent]] = None) -> List[TransformerInstance]:
     """
     
 
@@ -460,6 +574,8 @@ def transformer_insts_from_sst(sst: InstanceSST, world: World) -> List[Transform
         DESCRIPTION.
     world : World
         DESCRIPTION.
+    events : List[List[DECEvent]], optional
+        Events of the world's story (see `numbered_world_events`), created if not provided.
 
     Returns
     -------
@@ -467,17 +583,7 @@ def transformer_insts_from_sst(sst: InstanceSST, world: World) -> List[Transform
         DESCRIPTION.
 
     """
-    tis = []
-    decs = decs_from_sst(sst, world)
-    
-    for dec in decs:
-        dec_tis = dec_story_to_transformer_inputs(dec)
-        for i, dec_ti in enumerate(dec_tis):
-            dec_ti.id = f"{dec_ti.id}_{i}"  
-        tis += dec_tis
-        
-    
-    return tis
+    return list(iter_transformer_insts_from_sst(sst, world, events=events))
     
     
     
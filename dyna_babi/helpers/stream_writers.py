@@ -0,0 +1,188 @@
+from typing import Iterable, Dict
+from pathlib import Path
+import os
+
+from .event_calc import DECStory
+from .transformer_preproc import dec_story_to_transformer_inputs
+from .compression import ThreadedCompressedFile, compressed_path
+from .codec import encode_dec_story, encode_transformer_instance
+
+PARTIAL_SUFFIX = ".partial" # suffix of files still being written
+
+
+def tt_split_name(split: str) -> str:
+    """
+    DEC/TT files use `dev` instead of `valid` to conform to the tt format.
+    """
+    return "dev" if split == "valid" else split
+
+
+class AtomicWriter:
+    """
+    Append-mode text writer. Data is written to `<path>.partial` as it is
+    produced (so progress is visible during long runs), and the file is moved
+    to `path` with an atomic rename once `commit()` is called.
+    
+    If `compression` is given, the compression suffix is added to `path` and
+    data is compressed in a background thread. If a `tee` writer is given, all
+    data is also written to it, followed by a newline on commit (same as
+    `combine_files`).
+    """
+    def __init__(self, path: Path, compression: str = None, tee: "AtomicWriter" = None):
+        self.path = compressed_path(path, compression)
+        self.tee = tee
+        self.partial_path = self.path.with_name(self.path.name + PARTIAL_SUFFIX)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if compression:
+            self._f = ThreadedCompressedFile(self.partial_path, compression)
+        else:
+            self._f = self.partial_path.open("w")
+
+    @property
+    def closed(self) -> bool:
+        return self._f.closed
+
+    def write(self, data: str):
+        self._f.write(data)
+        if self.tee:
+            self.tee.write(data)
+
+    def flush(self):
+        self._f.flush()
+
+    def commit(self):
+        """
+        Close the partial file and atomically move it to its final path.
+        """
+        if not self.closed:
+            self._f.close()
+            os.replace(self.partial_path, self.path)
+            if self.tee:
+                # separate from the data of the next file
+                self.tee.write("\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            # leave the partial file in place for inspection
+            self._f.close()
+
+
+class JsonlWriter(AtomicWriter):
+    """
+    Writes one record per line. Records are separated by newlines with no
+    trailing newline, matching the output of `"\\n".join(records)`.
+    """
+    def __init__(self, path: Path, compression: str = None, tee: AtomicWriter = None):
+        super().__init__(path, compression=compression, tee=tee)
+        self.num_records = 0
+
+    def write_record(self, record: str):
+        if self.num_records > 0:
+            self.write("\n")
+        self.write(record)
+        self.num_records += 1
+
+    def write_records(self, records: Iterable[str]):
+        for record in records:
+            self.write_record(record)
+
+
+class CombinedWriters:
+    """
+    Writers of the combined (all tasks) files, one per file name, kept open
+    across tasks. Passed to `SplitWriter`s so that the combined files are
+    written while each task's files are generated, instead of combining the 
+    files in a second pass.
+    """
+    def __init__(self, combined_dir: Path, compression: str = None):
+        self.combined_dir = Path(combined_dir)
+        self.compression = compression
+        self.writers: Dict[str, AtomicWriter] = {}
+
+    def writer(self, source_path: Path) -> AtomicWriter:
+        name = Path(source_path).name
+        if name not in self.writers:
+            self.writers[name] = AtomicWriter(self.combined_dir / name, compression=self.compression)
+        return self.writers[name]
+
+    def commit(self):
+        for w in self.writers.values():
+            w.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for w in self.writers.values():
+            w.__exit__(exc_type, exc_val, exc_tb)
+
+
+class SplitWriter:
+    """
+    Streams the stories of a single split to each of the requested output
+    formats (bAbI, DEC, TT and columnar), one story at a time.
+    """
+    def __init__(self, out_dir: Path, split: str, write_babi: bool = True,
+                 write_dec: bool = False, write_tt: bool = False,
+                 write_columnar: bool = False, compression: str = None,
+                 combined: CombinedWriters = None):
+        out_dir = Path(out_dir)
+        self.split = split
+        def tee(path: Path) -> AtomicWriter:
+            return combined.writer(path) if combined else None
+        babi_path = out_dir / f"{split}.txt"
+        dec_path = out_dir / f"dec_{tt_split_name(split)}.jsonl"
+        tt_path = out_dir / f"{tt_split_name(split)}.jsonl"
+        self.babi_writer = AtomicWriter(babi_path, compression=compression,
+                                        tee=tee(babi_path)) if write_babi else None
+        self.dec_writer = JsonlWriter(dec_path, compression=compression,
+                                      tee=tee(dec_path)) if write_dec else None
+        self.tt_writer = JsonlWriter(tt_path, compression=compression,
+                                     tee=tee(tt_path)) if write_tt else None
+        self.columnar_writer = None
+        if write_columnar:
+            # optional dependency (pyarrow), only import when needed
+            from .columnar import ColumnarWriter
+            self.columnar_writer = ColumnarWriter(out_dir, split)
+
+    @property
+    def text_writers(self) -> list:
+        return [w for w in [self.babi_writer, self.dec_writer, self.tt_writer] if w]
+
+    @property
+    def writers(self) -> list:
+        return self.text_writers + ([self.columnar_writer] if self.columnar_writer else [])
+
+    def write_story(self, dec_story: DECStory):
+        if self.babi_writer:
+            self.babi_writer.write("".join(dec_story.babi_story))
+        if self.dec_writer:
+            self.dec_writer.write_record(encode_dec_story(dec_story))
+        if self.tt_writer:
+            self.tt_writer.write_records(encode_transformer_instance(ti) for ti in
+                                         dec_story_to_transformer_inputs(dec_story))
+        if self.columnar_writer:
+            # buffered into row groups, not flushed per story
+            self.columnar_writer.write_story(dec_story)
+        for w in self.text_writers:
+            w.flush()
+
+    def write_stories(self, dec_stories: Iterable[DECStory]):
+        for dec_story in dec_stories:
+            self.write_story(dec_story)
+
+    def commit(self):
+        for w in self.writers:
+            w.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for w in self.writers:
+            w.__exit__(exc_type, exc_val, exc_tb)
@@ -3,26 +3,38 @@ from typing import List, Dict, Optional, Union, Tuple
 import shortuuid
 from dataclasses import dataclass, asdict, field
 from dataclasses_json import dataclass_json
-from ..helpers.event_calc import DECStory, DECEvent, filter_keep_timesteps
+from ..helpers.event_calc import DECStory, DECEvent
+from ..helpers.babi_format import BabiLine
 
 
-def story_q_to_transformer_q(sents: List[str], q_timestep: int):
-    q_idx = q_timestep - 1
-    assert(len(sents) >= q_timestep)
-    story_lines = [line for line in sents[:q_idx] if not "?" in line]
-    question, answer = process_question_sent(sents[q_idx])
+def story_q_to_transformer_q(sents: List[str], q_line: BabiLine):
+    """
+    Input and answer of question `q_line`, following the (stripped) sentences `sents`.
+    """
+    story_lines = [line for line in sents if not "?" in line]
+    question, answer = q_line.question_answer()
     problem_input = "%s $question$ %s" %\
                             (' '.join([p for p in story_lines]), question)
     return problem_input, answer
         
     
-def process_question_sent(sent: str) -> Tuple[str,str]:
-    assert("?" in sent)
-    question, answer = sent.split("?")
-    answer = ' '.join([i for i in answer.strip().split() if not i.isnumeric()])
-    question = "%s?" % question
-    return question, answer
+def story_text_prefixes(sents: List[str]) -> Tuple[str, List[int]]:
+    """
+    Join the story (non question) sentences once. Returns the joined text and
+    the end offset of its prefix preceding each timestep, so the story part of
+    the input of the question at timestep `t` is `text[:ends[t-1]]`.
+    """
+    story_lines = []
+    ends = [0]
+    end = 0
+    for line in sents:
+        if not "?" in line:
+            end += len(line) + (1 if story_lines else 0) # joined with spaces
+            story_lines.append(line)
+        ends.append(end)
+    return ' '.join(story_lines), ends
     
+
 def process_line(line: str):
     line = line.strip()
     detail = ' '.join(line.split()[1:])
@@ -57,23 +69,29 @@ def dec_story_to_transformer_inputs(dec_story: DECStory, filter_distractors: boo
     """
     transformer_inputs = []
     stripped_lines = strip_sents(dec_story)
+    story_text, prefix_ends = story_text_prefixes(stripped_lines)
     for q_timestep in dec_story.question_sent_idxs():
         uid = dec_story.uid
         seed = dec_story.seed
         q_ev = dec_story.ev_by_timestep(q_timestep)[0]
         if filter_distractors:
-            # remove all distractor timesteps for the current q
-            filtered_dec = filter_keep_timesteps(dec_story, 
-                                                 keep_idxs= q_ev.supporting_facts + [q_timestep])
-            stripped_lines = strip_sents(filtered_dec)
+            # keep only the supporting facts of the current q, same as the story
+            # created by `filter_keep_timesteps` (without creating it)
+            keep_idxs = sorted(q_ev.supporting_facts + [q_timestep])
+            old_new_map = {t: i+1 for i,t in enumerate(keep_idxs)}
             
             new_q_timestep = len(q_ev.supporting_facts) + 1 # recalc new question idx
-            problem_input, answer = story_q_to_transformer_q(stripped_lines, new_q_timestep)
-            supp_facts = filtered_dec.ev_by_timestep(new_q_timestep)[0].supporting_facts
+            problem_input, answer = story_q_to_transformer_q([stripped_lines[t-1] for t in keep_idxs[:-1]],
+                                                             BabiLine.parse(dec_story.babi_story[q_timestep-1]))
+            new_q_ev = dec_story.ev_by_timestep(keep_idxs[new_q_timestep-1])[0]
+            supp_facts = [old_new_map[t] for t in new_q_ev.supporting_facts] if new_q_ev.is_q \
+                else list(new_q_ev.supporting_facts)
             
         else:
-            problem_input, answer = story_q_to_transformer_q(stripped_lines, q_timestep)
-            supp_facts = dec_story.ev_by_timestep(q_timestep)[0].supporting_facts
+            assert(len(stripped_lines) >= q_timestep)
+            question, answer = BabiLine.parse(dec_story.babi_story[q_timestep-1]).question_answer()
+            problem_input = "%s $question$ %s" % (story_text[:prefix_ends[q_timestep-1]], question)
+            supp_facts = q_ev.supporting_facts
             
         
         transformer_inputs.append(
@@ -1,33 +1,15 @@
 from typing import Set, List
 import numpy as np
 import numpy.random as random
-import re
+
+from .babi_format import BabiStory
 
 RANDOM_SEED = -1
-NUM_RE = re.compile(r"(\d+)") # to capture supporting facts idxs
-IDX_RE = re.compile(r"^(\d+)(?:\s+)")
 
 
 
     
 
-def replace_sent_idx(babi_sent: str, old_idx: int, new_idx: str):
-    # make sure arg is a string
-    repl = str(new_idx) + " " # add space between line number and sentence
-    return IDX_RE.sub(repl, babi_sent)
-
-def replace_supp_fact_idx(babi_sent: str, old_idx: int, new_idx: int):
-    res = babi_sent
-    repl_re = re.compile(r"(\s+)(" + str(old_idx) + ")(\s+|$)")
-    found = repl_re.findall(babi_sent)
-    assert(len(found) <= 1), f"len(found) > 1! found = {found}, babi_sent={babi_sent}, old/new_idx = {old_idx}/{new_idx}"
-    if found:
-        l,repl,r = found[0]
-        repl_str = "".join([l,str(new_idx),r])
-        res = repl_re.sub(repl_str, babi_sent)
-        
-    return res
-
 def reformat_lines(lines: List[str]):
     """ 
     """
@@ -40,40 +22,10 @@ def reformat_lines(lines: List[str]):
 
 
 def renumber_story(lines: List[str]):
-    
-    old_to_new_lines = {}
-    
-    
-    # collect old numbering
-    for i, l in enumerate(lines):
-        t = i+1
-        old_idx = IDX_RE.findall(l)
-        if old_idx:
-            old_to_new_lines[int(old_idx[0])] = t
-    
-    new_lines = []
-    for l in lines:
-        if not "?" in l:
-            new_lines.append(l)
-            continue
-        removed_idx = replace_sent_idx(l, 0,"")
-        supp_facts = extract_supp_facts(removed_idx)
-        for s in supp_facts:
-            # add special symbol to prevent replacing twice
-            rep_str = str(old_to_new_lines[s]) + "#"
-            l = replace_supp_fact_idx(l,s,rep_str)
-        
-        # remove special symbol
-        l = l.replace("#", "")
-        
-        new_lines.append(l)
-            
-    
-    # remove old line numbers
-    replaced = [replace_sent_idx(s, 0,"").lstrip() for s in new_lines]
-    
-    # replace with new and return 
-    return [f"{i+1} {s}" for i,s in enumerate(replaced)]
+    """ 
+    Renumber story lines 1..n, and supporting facts of questions accordingly.
+    """
+    return BabiStory.parse(lines).renumbered().to_lines()
         
 def supp_facts_str(supp_fact_idxs):
     # ensure sorted in ascending order
@@ -81,10 +33,6 @@ def supp_facts_str(supp_fact_idxs):
     idxs = " ".join([str(s) for s in supp_fact_idxs])
     return f"\t{idxs}"
 
-def extract_supp_facts(s):
-    supp_facts = [int(x) for x in NUM_RE.findall(s)]
-    return supp_facts
-
 def seed(s, checked_seeds: Set[int] = None):
     """ 
     Seed random number generator for reproduceability, return seed value.
@@ -138,9 +86,66 @@ def choice_np_rng(items, rng, k, replace: bool = False):
         return items_l
 
     eff_k = min(len(items_l), k)
-    chosen_idxs = rng.choice(len(items_l), eff_k, replace=replace)
+    chosen_idxs = set(rng.choice(len(items_l), eff_k, replace=replace).tolist())
     return [item for i, item in enumerate(items_l) if i in chosen_idxs]
 
+
+class ReservoirSampler:
+    """ 
+    Deterministic reservoir sampling of `k` items from a stream of unknown length
+    (Li's "Algorithm L"), using a seeded rng. Runs in linear time and only keeps
+    the `k` sampled items in memory.
+    """
+    def __init__(self, k: int, rng):
+        self.k = k
+        self.rng = rng
+        self.reservoir = [] # (stream position, item) pairs
+        self.n_seen = 0
+        if k > 0:
+            self._w = np.exp(np.log(self._uniform()) / k)
+            self._next = k - 1 + self._skip() + 1
+    
+    def _uniform(self) -> float:
+        # uniform sample in the open interval (0, 1)
+        u = self.rng.random_sample()
+        while u == 0.0:
+            u = self.rng.random_sample()
+        return u
+    
+    def _skip(self) -> int:
+        if self._w >= 1.0:
+            return 0
+        return int(np.floor(np.log(self._uniform()) / np.log1p(-self._w)))
+    
+    def add(self, item):
+        i = self.n_seen
+        self.n_seen += 1
+        if self.k <= 0:
+            return
+        if i < self.k:
+            self.reservoir.append((i, item))
+        elif i == self._next:
+            self.reservoir[self.rng.randint(self.k)] = (i, item)
+            self._w *= np.exp(np.log(self._uniform()) / self.k)
+            self._next = i + self._skip() + 1
+    
+    def extend(self, items):
+        for item in items:
+            self.add(item)
+        return self
+    
+    def sample(self, k: int = None) -> list:
+        """ 
+        Return the sampled items, in the order they appeared in the stream. If
+        `k` is smaller than the reservoir (e.g., fewer items than expected were
+        seen), return a uniform sample of `k` of them.
+        """
+        reservoir = self.reservoir
+        if k is not None and k < len(reservoir):
+            keep = self.rng.choice(len(reservoir), size=max(k, 0), replace=False)
+            reservoir = [reservoir[i] for i in keep]
+        return [item for _, item in sorted(reservoir, key=lambda x: x[0])]
+
 def sorted_item_set(item_set):
     # to iterate over set items in the same order for reproduceability
     sorted_items = sorted([(str(i), i) for i in list(item_set)])
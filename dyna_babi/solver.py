@@ -5,17 +5,21 @@ The answers of this solver are the more coherent ones - we leave it to the reade
 """
 
 import os
-from typing import Optional, List, Tuple, Dict
+from typing import Optional, List, Tuple, Dict, Iterable, Union
 import argparse
 from pathlib import Path
 import numpy.random as random
 from tqdm import tqdm
-import re
 import logging
+from multiprocessing import Pool
 
 from dyna_babi.game_variables_parser import get_game_variables, get_story_parameters, GameVariables, StoryParameters
 from dyna_babi.helpers.event_calc import DECStory
-from dyna_babi.helpers.utils import renumber_story, reformat_lines
+from dyna_babi.helpers.utils import reformat_lines
+from dyna_babi.helpers.babi_format import BabiLine, BabiStory, split_story_lines, iter_babi_file
+from dyna_babi.helpers.codec import encode_dec_story
+from dyna_babi.helpers.compression import strip_compression_suffix, with_compression_suffixes
+from dyna_babi.helpers.sentence_parser import SentenceParser
 from dyna_babi.world import World
 from dyna_babi.Entities.Location import Location
 from dyna_babi.Entities.Person import Person
@@ -27,6 +31,7 @@ from .inference_engine import InferenceEngine
 logging.basicConfig(level = logging.INFO)
 
 ALL_STORY_TASKS = [1,2,3,5,6,7,8,9,10,11,12,13]
+
 def entities_from_vars(world, vars):
     locations = [Location(world, location) for location in vars.locations]
     persons = [Person(world, person) for person in vars.persons]
@@ -45,208 +50,74 @@ def question_list_from_params(world, params):
     question_list.init_from_params(params.questions, params.questions_distribution)
     return question_list
 
-def act_line(world, vars, last_persons, task, idx, line):
+def act_line(world, parser: SentenceParser, last_persons, task, idx, line: Union[str, BabiLine]):
     """
-    if-elif-else to determine what the sentence is.
-    split the sentence. extract entities names, then actual entities.
-    do_specific action or question based on extracted data.
+    parse the sentence (raw or already parsed bAbI line) into an action or question kind and the names of its entities
+    (with `parser`, compiled for the world's vocabulary), then get the actual entities
+    and do_specific action or question.
     override = True will allow do_specific to ignore the current state of
     entities in the game world, and instead treat them as if they were in the state implied by the story
     """
-    params = world.params
-    coreferences = [" " + values[0] + " " for values in params.entity_coreference_map.values()]
+    parsed = parser.parse(line)
+    args = [world.get_entity_by_name(name) if name is not None else None for name in parsed.args]
 
     answer = None
     guess = None
-    is_q = False
+    is_q = parsed.is_q
     is_correct = False
 
-    words = re.findall(r"[\w']+", line)
-
-    if '\t' in line:
-        # question
-        is_q = True
-        if "was" in line:
-            # where was
-            object = world.get_entity_by_name(words[4])
-            location = world.get_entity_by_name(words[7])
-            answer = words[8]
-            _, guess = world.get_question_by_kind("where_was_object").ask_specific(object, location)
-        elif "Where" in line and "is the" in line:
-            # where object
-            object = world.get_entity_by_name(words[4])
-            answer = words[5]
-            _, guess = world.get_question_by_kind("where_object").ask_specific(object)
-        elif "Where" in line:
-            # where person
-            person = world.get_entity_by_name(words[3])
-            answer = words[4]
-            _, guess = world.get_question_by_kind("where_person").ask_specific(person)
-        elif "How many" in line:
-            # counting
-            person = world.get_entity_by_name(words[5])
-            answer = words[7]
-            _, guess = world.get_question_by_kind("counting").ask_specific(person)
-        elif "carrying" in line:
-            # listing
-            person = world.get_entity_by_name(words[3])
-            answers = [word for i, word in enumerate(words) if (i > 4) and word.isalpha()]
-            answers.sort()
-            answer_str = "".join([answer + "," for answer in answers])
-            answer = answer_str[:-1]
-            _, guess = world.get_question_by_kind("list").ask_specific(person)
-        elif "Is" in line:
-            # YesNo
-            person = world.get_entity_by_name(words[2])
-            location = world.get_entity_by_name(words[5])
-            answer = words[6]
-            _, guess = world.get_question_by_kind("yes_no").ask_specific(person, location)
-            a = 1
+    if is_q:
+        answer = parsed.answer
+        if parsed.kind == "giving":
+            _, guess = world.get_question_by_kind("giving").ask_specific(*args, parsed.sub_kind)
+        elif parsed.kind is not None:
+            _, guess = world.get_question_by_kind(parsed.kind).ask_specific(*args)
+    elif parsed.kind in ("move", "grab", "drop"):
+        if parsed.coref:
+            person, target = last_persons[0], args[0]
+            world.get_action_by_kind(parsed.kind).act_specific(person, target, override=True, coref=True)
         else:
-            # giving
-            # original giving task seems to be buggy - the answer to a "what_give" questions is the first object
-            # that was passed between the pair, instead of the last. my version is the correct one.
-            if "gave" in line and " to " in line:
-                object = world.get_entity_by_name(words[4])
-                person2 = world.get_entity_by_name(words[6])
-                answer = words[7]
-                _, guess = world.get_question_by_kind("giving").ask_specific(None, person2, object, "gave_to")
-            elif "gave" in line:
-                object = world.get_entity_by_name(words[4])
-                answer = words[5]
-                _, guess = world.get_question_by_kind("giving").ask_specific(None, None, object, "gave")
-            elif "received" in line:
-                object = world.get_entity_by_name(words[4])
-                answer = words[5]
-                _, guess = world.get_question_by_kind("giving").ask_specific(None, None, object, "received")
-            elif "Who" in line and "give" in line:
-                person1 = world.get_entity_by_name(words[3])
-                object = world.get_entity_by_name(words[6])
-                answer = words[8]
-                _, guess = world.get_question_by_kind("giving").ask_specific(person1, None, object, "who_give")
-            elif "What" in line and "give" in line:
-                person1 = world.get_entity_by_name(words[3])
-                person2 = world.get_entity_by_name(words[6])
-                answer = words[7]
-                _, guess = world.get_question_by_kind("giving").ask_specific(person1, person2, None, "what_give")
-    else:
-        coref = False
-        # action
-        if [move for move in params.move if move in line]:
-            # move, coref, conj, compound,
-            if [coref for coref in coreferences if coref in line]:
-                # move coref
-                coref = True
-                person = last_persons[0]
-                location = world.get_entity_by_name(words[-1])
-                world.get_action_by_kind("move").act_specific(person, location, override=True, coref=coref)
-            elif "they" in line:
-                # compound
-                coref = True
-                location = world.get_entity_by_name(words[-1])
-                world.get_action_by_kind("conj").act_specific(last_persons[0], last_persons[1], location, override=True, coref=coref)
-            elif len([person for person in vars.persons if person in line]) > 1:
-                # conj
-                person1 = world.get_entity_by_name(words[1])
-                person2 = world.get_entity_by_name(words[3])
-                location = world.get_entity_by_name(words[-1])
-                world.get_action_by_kind("conj").act_specific(person1, person2, location, override=True, coref=coref)
-                last_persons.clear()
-                last_persons.extend([person1, person2])
-            else:
-                # move
-                person = world.get_entity_by_name(words[1])
-                location = world.get_entity_by_name(words[-1])
-                world.get_action_by_kind("move").act_specific(person, location, override=True)
-                last_persons.clear()
-                last_persons.extend([person])
-        elif [grab for grab in params.grab if grab in line]:
-            # grab, coref
-            if [coref for coref in coreferences if coref in line]:
-                # coref
-                coref = True
-                try:
-                    words.remove("there")
-                    words.remove("up")
-                    
-                except ValueError:
-                    pass
-                person = last_persons[0]
-                object = world.get_entity_by_name(words[-1])
-                world.get_action_by_kind("grab").act_specific(person, object, override=True, coref=coref)
-            else:
-                #grab
-                try:
-                    words.remove("there")
-                    words.remove("up")
-                except ValueError:
-                    pass
-                person = world.get_entity_by_name(words[1])
-                object = world.get_entity_by_name(words[-1])
-                world.get_action_by_kind("grab").act_specific(person, object, override=True)
-                last_persons.clear()
-                last_persons.extend([person])
-        elif [drop for drop in params.drop if drop in line]:
-            # grab, coref
-            if [coref for coref in coreferences if coref in line]:
-                # coref
-                coref = True
-                try:
-                    words.remove("there")
-                    words.remove("down")
-                except ValueError:
-                    pass
-                person = last_persons[0]
-                object = world.get_entity_by_name(words[-1])
-                world.get_action_by_kind("drop").act_specific(person, object, override=True, coref=coref)
-            else:
-                # drop
-                try:
-                    words.remove("there")
-                    words.remove("down")
-                except ValueError:
-                    pass
-                person = world.get_entity_by_name(words[1])
-                object = world.get_entity_by_name(words[-1])
-                world.get_action_by_kind("drop").act_specific(person, object, override=True)
-                last_persons.clear()
-                last_persons.extend([person])
-        elif [give for give in params.give if give in line]:
-            # give
-            person1 = world.get_entity_by_name(words[1])
-            person2 = world.get_entity_by_name(words[6])
-            object = world.get_entity_by_name(words[4])
-            world.get_action_by_kind("give").act_specific(person1, person2, object, override=True)
-            last_persons.clear()
-            last_persons.extend([person1])
-        elif "either" in line:
-            person = world.get_entity_by_name(words[1])
-            location1 = world.get_entity_by_name(words[6])
-            location2 = world.get_entity_by_name(words[9])
-            world.get_action_by_kind("indef").act_specific(person, location1, location2, override=True)
+            person, target = args
+            world.get_action_by_kind(parsed.kind).act_specific(person, target, override=True)
             last_persons.clear()
             last_persons.extend([person])
-        elif "is" in line:
-            # negate
-            person = world.get_entity_by_name(words[1])
-            location = world.get_entity_by_name(words[-1])
-            negate = ""
-            for neg in params.negate:
-                if neg in line:
-                    negate = neg
-                    break
-            world.get_action_by_kind("negate").act_specific(person, negate, location, override=True)
+    elif parsed.kind == "conj":
+        if parsed.coref:
+            # compound
+            world.get_action_by_kind("conj").act_specific(last_persons[0], last_persons[1], args[0],
+                                                          override=True, coref=True)
+        else:
+            person1, person2, location = args
+            world.get_action_by_kind("conj").act_specific(person1, person2, location, override=True, coref=False)
             last_persons.clear()
-            last_persons.extend([person])
+            last_persons.extend([person1, person2])
+    elif parsed.kind == "give":
+        person1, person2, object = args
+        world.get_action_by_kind("give").act_specific(person1, person2, object, override=True)
+        last_persons.clear()
+        last_persons.extend([person1])
+    elif parsed.kind == "indef":
+        person, location1, location2 = args
+        world.get_action_by_kind("indef").act_specific(person, location1, location2, override=True)
+        last_persons.clear()
+        last_persons.extend([person])
+    elif parsed.kind == "negate":
+        person, location = args
+        world.get_action_by_kind("negate").act_specific(person, parsed.sub_kind, location, override=True)
+        last_persons.clear()
+        last_persons.extend([person])
 
     if is_q:
-        if answer is not None and guess is not None and guess == answer:
-            is_correct = True
-        else:
-            print("Mismatch in task {} in line {}: answer is {}, but guess was {}.".format(task, idx, answer, guess))
+        is_correct = check_answer(task, idx, answer, guess)
     return is_q, is_correct
 
 
+def check_answer(task, idx, answer, guess) -> bool:
+    if answer is not None and guess is not None and guess == answer:
+        return True
+    print("Mismatch in task {} in line {}: answer is {}, but guess was {}.".format(task, idx, answer, guess))
+    return False
+
 def get_lines(task, tasks_dir: str = None):
     if not tasks_dir:
         tasks_dir = "../babi_data/tasks_1-20_v1-2/en-valid-10k"
@@ -273,7 +144,7 @@ def write_dec_stories(output_dir, dec_stories):
         if split == "valid":
             split = "dev" # switch to conform to tt format
         dec_split_file = output_dir / (f"dec_{split}.jsonl")
-        json_stories = [dec_story.to_json() for dec_story in stories]
+        json_stories = [encode_dec_story(dec_story) for dec_story in stories]
         print(f"Writing {len(json_stories)} to {split}...")
         dec_split_file.write_text("\n".join(json_stories))
             
@@ -294,6 +165,7 @@ def solve_babi(vars, params, tasks, tasks_dir, dec_output_path):
     action_list = action_list_from_params(world, params)
     question_list = question_list_from_params(world, params)
     world.rule(params, action_list, question_list)
+    parser = SentenceParser(params, vars)
 
     for task in tasks:
         print(f"Processing task {task}...")
@@ -310,8 +182,9 @@ def solve_babi(vars, params, tasks, tasks_dir, dec_output_path):
             story_lines = []
             
             for i, line in tqdm(enumerate(split), total=len(split)):
-                world.timestep = int(line.split()[0])
-                if line.split()[0] == "1":
+                babi_line = BabiLine.parse(line)
+                world.timestep = babi_line.idx
+                if world.timestep == 1:
                     if story_lines and write_dec:
                         # if not first line of file
                         dec = world.to_dec_story(story_lines)
@@ -325,7 +198,7 @@ def solve_babi(vars, params, tasks, tasks_dir, dec_output_path):
                     world.allocate()
                     world.timestep = 1
                     
-                is_q, is_correct = act_line(world, vars, last_persons, task, i, line)
+                is_q, is_correct = act_line(world, parser, last_persons, task, i, babi_line)
                 story_lines.append(line)
                 if is_q:
                     questions += 1
@@ -356,6 +229,7 @@ def solve_story(vars, params, lines, write_dec: bool = False):
     action_list = action_list_from_params(world, params)
     question_list = question_list_from_params(world, params)
     world.rule(params, action_list, question_list)
+    parser = SentenceParser(params, vars)
     
     task = 0
     questions = 0
@@ -366,8 +240,9 @@ def solve_story(vars, params, lines, write_dec: bool = False):
     dec_stories = []
     
     for i, line in tqdm(enumerate(lines), total=len(lines)):
-        world.timestep = int(line.split()[0])
-        if line.split()[0] == "1":
+        babi_line = BabiLine.parse(line)
+        world.timestep = babi_line.idx
+        if world.timestep == 1:
             if story_lines and write_dec:
                 # if not first line of file
                 dec = world.to_dec_story(story_lines)
@@ -381,7 +256,7 @@ def solve_story(vars, params, lines, write_dec: bool = False):
             world.allocate()
             world.timestep = 1
             
-        is_q, is_correct = act_line(world, vars, last_persons, task, i, line)
+        is_q, is_correct = act_line(world, parser, last_persons, task, i, babi_line)
         story_lines.append(line)
         if is_q:
             questions += 1
@@ -404,8 +279,9 @@ def reset_world(world):
     return world
 
 
-def init_world(params: StoryParameters, vars: GameVariables):
-    world = World(params=params)
+def init_world(params: StoryParameters, vars: GameVariables, 
+               output_formats: Optional[Iterable[str]] = None):
+    world = World(params=params, output_formats=output_formats)
 
     entities = entities_from_vars(world, vars)
     world.populate(entities)
@@ -416,29 +292,63 @@ def init_world(params: StoryParameters, vars: GameVariables):
     return world
 
 
+def split_stories(lines: List[str]) -> List[List[str]]:
+    """
+    Break lines of stories in bAbI format into a list of stories' lines.
+    """
+    return split_story_lines(lines)
+
+
+# solver of the current pool worker process
+_worker_solver = None
+
+def _init_solver_worker(story_params: StoryParameters, game_vars: GameVariables, inject_qs: bool,
+                        output_formats: Optional[Iterable[str]] = None):
+    global _worker_solver
+    _worker_solver = DumbSolver(story_params=story_params, game_vars=game_vars, inject_qs=inject_qs,
+                                output_formats=output_formats)
+
+
+def _solve_story_batch(args) -> List[Dict]:
+    stories, create_dec = args
+    return [_worker_solver.solve_story(story_lines, create_dec) for story_lines in stories]
+
+
 class DumbSolver:
     """
     Rule-based solver for bAbI stories. Solves any bAbI task from 1-13 or any mix of them, using old-school procedural coding.
+    
+    If `n_workers` > 1, stories are solved in a pool of `n_workers` processes, each
+    with its own solver world, `chunksize` stories at a time.
+    
+    Propositions of solved stories (`world.diff_props`) are only tracked if one
+    of `output_formats` is built from them (e.g., "sst"), or if it is None.
     """
     def __init__(self, story_params: Optional[StoryParameters] = None, 
                  game_vars: Optional[GameVariables] = None,
-                 inject_qs: bool = False):
+                 inject_qs: bool = False, n_workers: int = 1, chunksize: int = 32,
+                 output_formats: Optional[Iterable[str]] = None):
         self.params = story_params if story_params else StoryParameters()
         self.vars = game_vars if game_vars else GameVariables()
-        self.world = init_world(self.params, self.vars)
+        self.output_formats = output_formats
+        self.world = init_world(self.params, self.vars, output_formats=output_formats)
+        # compiled once, for the vocabulary of the solver's params and variables
+        self.parser = SentenceParser(self.params, self.vars)
         self.dec_stories = []
         
         self.inject_qs = inject_qs
+        self.n_workers = n_workers
+        self.chunksize = chunksize
     
-    def solve_story(self, lines: List[str], create_dec: bool = False) -> Dict:
+    def solve_story(self, lines: Union[List[str], BabiStory], create_dec: bool = False) -> Dict:
         """
         Solves story provided as input in bAbI format.
         
 
         Parameters
         ----------
-        lines : List[str]
-            Story lines in bAbI format.
+        lines : Union[List[str], BabiStory]
+            Story lines in bAbI format, or the already parsed story.
         create_dec : bool, optional
             Create and return the story in structured format. The default is False.
 
@@ -461,47 +371,23 @@ class DumbSolver:
         world = self.world
         self.world = reset_world(self.world)
         
-        for i, line in enumerate(lines):
-            world.timestep = int(line.split()[0])
-            is_q, is_correct = act_line(world, self.vars, last_persons, task, i, line)
-            story_lines.append(line)
-            if is_q:
-                questions += 1
-                if self.inject_qs:
-                    all_qs = list(world.ask(exhaustive=True))
-                    if all_qs:
-                        q_lines = [q[0]+"\n" for q in all_qs[0]]
-                        questions += len(all_qs)
-                        story_lines += q_lines
-                if is_correct:
-                    correct += 1
+        # each line is parsed once, and raw lines kept for the story's DEC form
+        if isinstance(lines, BabiStory):
+            babi_lines, lines = lines.lines, lines.to_lines()
+        else:
+            babi_lines = [BabiLine.parse(line) for line in lines]
         
-        # go over all lines again after questions added
         if self.inject_qs:
-            questions = 0
-            task = 0
-            correct = 0
-            
-            # renumber lines
-            renumbered_lines = renumber_story(story_lines)
-            
-            
-            
-            self.world = reset_world(self.world)
-            new_story_lines = []
-            for i, line in enumerate(renumbered_lines):
-                world.timestep = int(line.split()[0])
-                is_q, is_correct = act_line(world, self.vars, last_persons,
-                                            task, i, line)
-                new_story_lines.append(line)
+            story_lines, questions, correct = self._solve_inject(babi_lines, last_persons, task)
+        else:
+            for i, (babi_line, line) in enumerate(zip(babi_lines, lines)):
+                world.timestep = babi_line.idx
+                is_q, is_correct = act_line(world, self.parser, last_persons, task, i, babi_line)
+                story_lines.append(line)
                 if is_q:
                     questions += 1
                     if is_correct:
                         correct += 1
-            story_lines = new_story_lines
-            
-            # reformat lines
-            story_lines = reformat_lines(story_lines)
     
         # add last story
         if create_dec:
@@ -536,6 +422,46 @@ class DumbSolver:
         
         
     
+    def _solve_inject(self, lines: List[BabiLine], last_persons: List, task: int) -> Tuple[List[str], int, int]:
+        """
+        Solve story lines while injecting all valid questions after each question.
+        Lines are renumbered as they are emitted (supporting facts through an old
+        -> new line index map), and the world runs on the new numbering, so the
+        story is only simulated once.
+        """
+        world = self.world
+        parser = self.parser
+        old_to_new = {}
+        story_lines = []
+        questions = 0
+        correct = 0
+        
+        for line in lines:
+            t = len(story_lines) + 1
+            old_to_new[line.idx] = t
+            line = line.renumbered(t, old_to_new)
+            
+            world.timestep = t
+            is_q, is_correct = act_line(world, parser, last_persons, task, t-1, line)
+            story_lines.append(line.to_str())
+            if is_q:
+                questions += 1
+                if is_correct:
+                    correct += 1
+                # asked at the following timesteps, with supporting facts in the new numbering
+                all_qs = list(world.ask(exhaustive=True))
+                if all_qs:
+                    for q, guess in zip(*all_qs):
+                        t = len(story_lines) + 1
+                        q_line = f"{t} {q[0]}\n"
+                        parsed = parser.parse(q_line)
+                        questions += 1
+                        if check_answer(task, t-1, parsed.answer, guess):
+                            correct += 1
+                        story_lines.append(q_line)
+        
+        return reformat_lines(story_lines), questions, correct
+    
     def solve_stories(self, lines: List[str], create_decs: bool = False) -> Dict:
         """
         Solve sequence of stories provided in bAbI format.
@@ -557,28 +483,53 @@ class DumbSolver:
                 - decs: List of stories in structured format, if specified.
 
         """
+        return self._solve_stories(split_stories(lines), create_decs)
+    
+    def _solve_stories(self, all_stories: List[Union[List[str], BabiStory]], create_decs: bool = False) -> Dict:
+        if self.n_workers > 1:
+            results = self.solve_parallel([all_stories], create_decs)[0]
+        else:
+            results = (self.solve_story(story_lines, create_decs) for story_lines in 
+                       tqdm(all_stories, total=len(all_stories)))
+        
+        return self._merge_results(results, create_decs)
+    
+    @staticmethod
+    def _merge_results(results: List[Dict], create_decs: bool = False) -> Dict:
         all_res = {"num_q": 0,
                "num_correct": 0,
                "decs": []}
-        starts = [i for i,l in enumerate(lines[:-1]) if l.split()[0] == "1"] + [len(lines)]
-        
-        # break into list of n sublists, each containing one story's lines
-        all_lines = [lines[starts[i]:starts[i+1]] for i in
-                     range(len(starts)-1)]
-        
-        # solve stories
-        for story_lines in tqdm(all_lines, total=len(all_lines)):
-            res = self.solve_story(story_lines, create_decs)
+        for res in results:
             if create_decs:
                 all_res["decs"].append(res["dec"])
             all_res["num_q"] += res["num_q"]
             all_res["num_correct"] += res["num_correct"]
-        
-        
-        
-        
         return all_res
     
+    def solve_parallel(self, stories_lists: List[List[Union[List[str], BabiStory]]], 
+                       create_decs: bool = False) -> List[List[Dict]]:
+        """
+        Solve lists of stories (e.g., of different files) in a pool of worker
+        processes, in chunks of `self.chunksize` stories.
+
+        Returns
+        -------
+        List[List[Dict]]
+            `solve_story` results of each list of stories, in input order.
+
+        """
+        batches = [(list_idx, stories[i:i+self.chunksize]) 
+                   for list_idx, stories in enumerate(stories_lists)
+                   for i in range(0, len(stories), self.chunksize)]
+        all_results = [[] for _ in stories_lists]
+        with Pool(self.n_workers, initializer=_init_solver_worker,
+                  initargs=(self.params, self.vars, self.inject_qs, self.output_formats)) as pool:
+            batch_results = pool.imap(_solve_story_batch, 
+                                      [(batch, create_decs) for _, batch in batches])
+            for (list_idx, _), results in tqdm(zip(batches, batch_results), total=len(batches)):
+                all_results[list_idx] += results
+        return all_results
+    
     def solve_file(self, file_path: Path, out_dir: Path = None) -> Dict:
         """
         Load and solve file of stories in bAbI format.
@@ -596,27 +547,29 @@ class DumbSolver:
             Same as `solve_stories`.
 
         """
-        out_dir = Path(out_dir)
+        out_dir = Path(out_dir) if out_dir else None
         
         logging.info(f"Starting processing: {file_path}...")
-        with file_path.open() as f:
-            all_lines = f.readlines()
+        # input may be compressed, lines are parsed as they are read
+        all_stories = list(iter_babi_file(file_path))
         
         write_decs = out_dir != None
         
-        res = self.solve_stories(all_lines, create_decs=write_decs)
+        res = self._solve_stories(all_stories, create_decs=write_decs)
+        self._write_file_results(file_path, res, out_dir)
+        
+        return res
+    
+    def _write_file_results(self, file_path: Path, res: Dict, out_dir: Path = None):
         logging.info(f"Processed {res.get('num_q')} questions , {res.get('num_correct')} correct.")
         
         if out_dir:
             out_dir.mkdir(parents=True, exist_ok=True)
-            dec_split_file = out_dir / (f"{file_path.stem}_dec.jsonl")
-            json_stories = [dec_story.to_json() for dec_story in res["decs"]]
+            dec_split_file = out_dir / (f"{strip_compression_suffix(file_path).stem}_dec.jsonl")
+            json_stories = [encode_dec_story(dec_story) for dec_story in res["decs"]]
             logging.info(f"Writing {len(json_stories)} stories to {dec_split_file}...")
             dec_split_file.write_text("\n".join(json_stories))
             
-        
-        return res
-            
     def solve_dir(self, in_dir: Path, out_dir: Path = None):
         """
         Solve all files in the input directory.
@@ -637,9 +590,23 @@ class DumbSolver:
         in_dir = Path(in_dir)
         logging.info(f"Starting processing dir: {in_dir}...")
         all_res = {}
-        for f in in_dir.glob("*.txt"):
-            res = self.solve_file(f, out_dir)
-            all_res[f.stem] = res
+        # input files may be compressed
+        files = [f for pattern in with_compression_suffixes(["*.txt"]) for f in in_dir.glob(pattern)]
+        
+        if self.n_workers > 1:
+            # solve stories of all files in the same pool
+            out_dir = Path(out_dir) if out_dir else None
+            write_decs = out_dir != None
+            stories_lists = [list(iter_babi_file(f)) for f in files]
+            all_results = self.solve_parallel(stories_lists, create_decs=write_decs)
+            for f, results in zip(files, all_results):
+                res = self._merge_results(results, create_decs=write_decs)
+                self._write_file_results(f, res, out_dir)
+                all_res[strip_compression_suffix(f).stem] = res
+        else:
+            for f in files:
+                res = self.solve_file(f, out_dir)
+                all_res[strip_compression_suffix(f).stem] = res
         return all_res
         
             
@@ -92,6 +92,8 @@ class StoryFilter:
         self.q_sig_counter = Counter()   
         self.passed_count = 0
         self.failed_count = 0
+        # old -> new timesteps of the last story filtered, if it was renumbered
+        self.last_old_new_map = None
         
     @classmethod
     def from_filter_config_file(cls, filter_config_file: str):
@@ -141,12 +143,13 @@ class StoryFilter:
         
         if keep_q_idxs:
             all_keep_idxs = list(sorted(story_idxs + keep_q_idxs + conditional_keep_idxs))
-            filtered_dec = filter_keep_timesteps(story, all_keep_idxs)   
+            filtered_dec, self.last_old_new_map = filter_keep_timesteps(story, all_keep_idxs, return_map=True)
             return True, filtered_dec
         else:
             return False, story
     
     def filter_story(self, story: DECStory) -> Tuple[bool, DECStory]:
+        self.last_old_new_map = None
         if self.config.filter_each_q:
             passed_filter, filtered_story = self.filter_each_q(story)
         else:
@@ -273,6 +276,7 @@ class FilterBank:
             self.configs = filter_configs
             
         self.filters = [StoryFilter(c) for c in self.configs]
+        self.last_old_new_map = None
         
     
     def config_json(self) -> str:
@@ -322,6 +326,7 @@ class FilterBank:
             # pass story through each filter, break for first filter story passes
             # so we are only counting each story once
             passed_filter, filtered_story = story_filter.filter_story(story)
+            self.last_old_new_map = story_filter.last_old_new_map
             if passed_filter:
                 break
         
@@ -1,68 +1,168 @@
-from typing import Tuple, List
+from typing import Tuple, List, Iterator
 from pathlib import Path
 import tqdm
-import pandas as pd
 import logging
 from collections import OrderedDict, defaultdict
+from multiprocessing import Pool
 
 from .helpers.event_calc import DECEvent, DECStory
+from .helpers.compression import open_text
+from .helpers.dec_index import DECFileIndex
+from .helpers.codec import decode_dec_story
+from .helpers.dec_binary import BinaryDECReader, BINARY_DEC_SUFFIX
 
 logging.basicConfig(level = logging.INFO)
 
 def extract_q_str(q_sent: str) -> str:
     return " ".join(q_sent.split("\t")[0].split(" ")[1:])
 
+def _parse_dec_line(line: str) -> DECStory:
+    return decode_dec_story(line)
+
+def iter_dec_stories(dec_file: Path, n_workers: int = 1, chunksize: int = 64) -> Iterator[DECStory]:
+    """
+    Read a (possibly compressed) DEC file line by line, yielding DECStory objects
+    in file order.
+
+    Parameters
+    ----------
+    dec_file : Path
+        DEC file (.jsonl), one story per line.
+    n_workers : int, optional
+        If > 1, parse stories in `n_workers` processes. The default is 1.
+    chunksize : int, optional
+        Number of lines sent to a worker at a time. The default is 64.
+    """
+    with open_text(dec_file) as f:
+        # skip empty lines (e.g., between files in combined DEC files)
+        lines = (line for line in f if line.strip())
+        if n_workers > 1:
+            with Pool(n_workers) as pool:
+                yield from pool.imap(_parse_dec_line, lines, chunksize=chunksize)
+        else:
+            for line in lines:
+                yield _parse_dec_line(line)
+
 class StoryReader:
-    def __init__(self, dec_file: Path, deep_load: bool = False):
+    """
+    Reads stories from a DEC file by uid or question id. Lookups go through a 
+    uid -> byte offset index of the file (built once and written next to the file,
+    unless `persist_index` is False), and the last `cache_size` parsed stories are
+    cached. Only `deep_load` keeps all the stories in memory. Binary DEC files
+    (.decb) are also supported. Close the reader (or use it as a context manager)
+    to release the file.
+    """
+    def __init__(self, dec_file: Path, deep_load: bool = False, cache_size: int = 1024,
+                 n_workers: int = 1, persist_index: bool = True):
         self.dec_file = dec_file
-        self.stories_df = pd.read_json(str(dec_file), lines=True)
+        self.persist_index = persist_index
+        self._index = None
+        self._stories_df = None
+        self.n_workers = n_workers
         self.dec_dict = OrderedDict()
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
         self.all_q_ids = []
         self.handle_dups = False
         if deep_load:
             self.deep_load()
             
+    @property
+    def is_binary(self) -> bool:
+        return Path(self.dec_file).suffix == BINARY_DEC_SUFFIX
+    
+    @property
+    def index(self):
+        # only built when random access is needed
+        if self._index is None:
+            if self.is_binary:
+                self._index = BinaryDECReader(self.dec_file)
+            else:
+                self._index = DECFileIndex(self.dec_file, persist=self.persist_index)
+        return self._index
+    
+    def close(self):
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    def __iter__(self) -> Iterator[DECStory]:
+        return self.iter_stories()
+    
+    def iter_stories(self, n_workers: int = None) -> Iterator[DECStory]:
+        """
+        Stream all stories in the file, in order, without loading the whole file.
+        """
+        if self.is_binary:
+            return iter(self.index)
+        n_workers = self.n_workers if n_workers is None else n_workers
+        return iter_dec_stories(self.dec_file, n_workers=n_workers)
+    
+    @property
+    def stories_df(self):
+        # only load into pandas if needed
+        if self._stories_df is None:
+            import pandas as pd
+            if self.is_binary:
+                self._stories_df = pd.DataFrame([dec.to_dict() for dec in self.index])
+            else:
+                # dec file may be compressed
+                with open_text(self.dec_file) as f:
+                    self._stories_df = pd.read_json(f, lines=True)
+        return self._stories_df
         
     def deep_load(self):
         logging.info("Deep loading all stories in the split for quick future access. This may take a while...")
-        for i in tqdm.tqdm(range(len(self.stories_df)), total=len(self.stories_df)):
-            story_dict = self.stories_df.loc[i].to_dict()
-            dec = DECStory.from_dict(story_dict)
+        for dec in tqdm.tqdm(self.iter_stories()):
             self.dec_dict[dec.uid] = dec
         self.all_q_ids = self._all_qids()
     
     def story_by_id(self, story_id: str) -> DECStory:
-        story_df = self.stories_df[self.stories_df.uid == story_id]
-        assert(len(story_df) == 1), f"Two stories with same id {story_id}"
-        idx = story_df.index.item()
-        story_dict = self.stories_df.loc[idx].to_dict()
-        dec = DECStory.from_dict(story_dict)
+        if story_id in self.dec_dict:
+            return self.dec_dict[story_id]
+        if story_id in self._cache:
+            self._cache.move_to_end(story_id)
+            return self._cache[story_id]
+        assert(story_id not in self.index.dup_uids), f"Two stories with same id {story_id}"
+        if self.is_binary:
+            dec = self.index.story_by_uid(story_id)
+        else:
+            dec = decode_dec_story(self.index.line_by_uid(story_id))
+        self._cache[story_id] = dec
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
         return dec
     
     def story_by_qid(self, qid: str) -> Tuple[DECStory, DECEvent]:
         story_id, q_id = qid.split("_")
         q_id = int(q_id)
-        if story_id not in self.dec_dict:
-            dec = self.story_by_id(story_id)
-            self.dec_dict[story_id] = dec
-        else:
-            dec = self.dec_dict[story_id]
+        dec = self.story_by_id(story_id)
         q = dec.ev_by_timestep(q_id)
         assert(len(q) == 1), f"More than one event exists for timestep {q_id}: {q}!"
         q = q[0]
         return dec, q
     
+    def _qid_stories(self) -> Iterator[DECStory]:
+        # all stories of the file, streamed if they weren't deep loaded
+        return iter(self.dec_dict.values()) if self.dec_dict else self.iter_stories()
+    
     def _all_qids(self) -> List[str]:
         all_qids = []
-        for uid, dec in self.dec_dict.items():
-            qids = [f"{uid}_{t}" for t in dec.question_sent_idxs()]
+        for dec in self._qid_stories():
+            qids = [f"{dec.uid}_{t}" for t in dec.question_sent_idxs()]
             all_qids += qids
         return all_qids
     
     def all_qid_strs(self) -> List[Tuple[str, str]]:
         all_qids_q_strs = []
-        for uid, dec in self.dec_dict.items():
-            qids = [(f"{uid}_{t}", f"{dec.babi_story[t-1]}") for t in dec.question_sent_idxs()]
+        for dec in self._qid_stories():
+            qids = [(f"{dec.uid}_{t}", f"{dec.babi_story[t-1]}") for t in dec.question_sent_idxs()]
             all_qids_q_strs += qids
         return list(all_qids_q_strs)
             
@@ -1,7 +1,8 @@
 
-from typing import List, Dict
+from typing import List, Dict, Set
 from pathlib import Path
 import os
+import sys
 from shutil import copyfile
 import argparse
 import numpy.random as random
@@ -23,8 +24,11 @@ from .Actions.ActionList import ActionList
 from .Questions.QuestionList import QuestionList
 
 from .story_filter import StoryFilter, FilterConfig, FilterBank
-from .helpers.utils import RANDOM_SEED, seed, choice_np_rng
-from .helpers.transformer_preproc import dec_story_to_transformer_inputs
+from .helpers.utils import RANDOM_SEED, seed, ReservoirSampler
+from .helpers.stream_writers import SplitWriter
+from .helpers.spill_store import SpilledStoryStore
+from .helpers.belief_npy import BeliefNpyWriter
+from .helpers.compression import check_compression
 from .helpers.sst.instance_sst import dec_to_sst_insts, SSTSampleOptions, InstanceSST, transformer_insts_from_sst, dec_to_sst_qa_insts
 from .helpers.event_calc import DECStory, DECEvent, check_dec_answers_consistency
 from .inference_engine import InferenceEngine
@@ -73,11 +77,15 @@ class StoryWriterConfig:
     no_write: bool = False # for debugging - doesn't generate any output files
     write_dec: bool = False # write ouput in DEC format
     write_tt: bool = False # write output in TransformerInstance format
+    write_columnar: bool = False # write question/sentence tables in Parquet format (requires pyarrow)
+    write_belief_npy: bool = False # write belief matrices (timestep x proposition) of all accepted stories as .npy tensors
+    compression: str = None # compress bAbI/DEC/TT output files, one of gzip, xz or zstd (requires zstandard)
     use_new_engine: bool = False
     story_subsample_pct: float = 1
     seeds_file: str = None
     filter_config_file: str = None
     only_dev: bool = False
+    spill_dir: str = None # dir for on-disk store of accepted stories (default: system temp dir)
     # for generating data in breakpoint transformers format
     write_sst: bool = False 
     sst_to_vt: bool =  False
@@ -91,12 +99,25 @@ class StoryWriterConfig:
             self.var_files = [os.path.abspath(var_file) for var_file in self.var_files]
         if self.param_file:
             self.param_file = os.path.abspath(self.param_file)
+        check_compression(self.compression)
 
 
     @property
     def out_path(self):
         return Path(self.out_dir)
     
+    @property
+    def output_formats(self) -> Set[str]:
+        """
+        Names of the requested output formats.
+        """
+        if self.no_write:
+            return set()
+        flags = {"babi": True, "dec": self.write_dec, "tt": self.write_tt,
+                     "columnar": self.write_columnar, "belief_npy": self.write_belief_npy,
+                     "sst": self.write_sst, "sst_vt": self.sst_to_vt, "sst_qa": self.sst_qa}
+        return {fmt for fmt, requested in flags.items() if requested}
+    
     
     
 
@@ -124,14 +145,17 @@ def action_list_from_params(world, params):
     return action_list
 
 
-def question_list_from_params(world, params):
+def question_list_from_params(world, params, actions=None):
     """
     Extracts questions from the StoryParameters object params.
     :param world: A World object
     :param params: A StoryParameters object
+    :param actions: kinds of the world's actions, if given only the questions needed for params and actions
+                    track known items
     """
     question_list = QuestionList(world)
-    question_list.init_from_params(params.questions, params.questions_distribution)
+    question_list.init_from_params(params.questions, params.questions_distribution,
+                                   actions=actions)
     return question_list
 
 
@@ -147,15 +171,16 @@ def add_sentences(data, sentences, sentence_idx):
         sentence_idx += 1
     return data, sentence_idx
 
-def init_world(params, vars):
+def init_world(params, vars, output_formats=None):
     """ 
-    Initialize world with given parameters and variables.
+    Initialize world with given parameters and variables. Propositions are only
+    tracked if needed for `output_formats` (all formats if None).
     """
-    world = World(params=params)
+    world = World(params=params, output_formats=output_formats)
     entities = entities_from_vars(world, vars)
     world.populate(entities)
     action_list = action_list_from_params(world, params)
-    question_list = question_list_from_params(world, params)
+    question_list = question_list_from_params(world, params, actions=action_list.action_kinds())
     world.rule(params, action_list, question_list)
     return world
 
@@ -190,6 +215,8 @@ class StoryWriter(object):
         story_seeds_seed = np.random.randint(1, np.iinfo(np.int32).max)
         # seed for generating new story seeds
         self.story_seeds_rng = np.random.RandomState(story_seeds_seed)
+        # separate rng for subsampling, so as not to affect the story seeds
+        self.subsample_rng = np.random.RandomState(story_seeds_seed + 1)
         
 
         if self.config.only_dev:
@@ -202,9 +229,8 @@ class StoryWriter(object):
             self.set_names = ["_train", "_valid", "_test"]
     
         
-        # store stories in dec form
+        # store stories in dec form, spilled to disk to keep memory bounded
         self.dec_stories = {}
-        self.dec_map_by_uid = defaultdict(lambda: defaultdict(list))
         
         # for storing instances in sst format
         self.sst_instances = defaultdict(list)
@@ -245,6 +271,18 @@ class StoryWriter(object):
             self.filtering = True
         
         self._uids_to_write = defaultdict(lambda: defaultdict(list))
+        
+        # writer for the split currently being generated, if streaming outputs
+        self._split_writer = None
+        
+        # writer of belief matrices for the split currently being generated
+        self._belief_writer = None
+        
+        # reservoir sampler of the uids of the split currently being generated, if subsampling
+        self._subsampler = None
+        
+        # writers of combined (multi-task) files to tee outputs to, if any
+        self.combined_writers = None
 
     
     @property
@@ -256,6 +294,26 @@ class StoryWriter(object):
         # return True if in no write mode
         return self.config.no_write
     
+    @property
+    def stream_outputs(self) -> bool:
+        """
+        Stories are written as soon as they are accepted, unless they need to
+        be subsampled first (which is only decided once a split is complete).
+        """
+        return (not self.no_write) and self.config.story_subsample_pct >= 1
+    
+    def open_split_writer(self, split: str, write_babi: bool = True,
+                          write_dec: bool = None, write_tt: bool = None,
+                          write_columnar: bool = None, tee: bool = False) -> SplitWriter:
+        write_dec = self.config.write_dec if write_dec is None else write_dec
+        write_tt = self.config.write_tt if write_tt is None else write_tt
+        write_columnar = self.config.write_columnar if write_columnar is None else write_columnar
+        return SplitWriter(self.out_dir, split, write_babi=write_babi,
+                           write_dec=write_dec, write_tt=write_tt,
+                           write_columnar=write_columnar,
+                           compression=self.config.compression,
+                           combined=self.combined_writers if tee else None)
+    
     def prepare_out_dir(self):
         
         self.out_dir.mkdir(parents=True, exist_ok=True)
@@ -278,7 +336,7 @@ class StoryWriter(object):
         seeds["initial"] = self.rseed
         for split, stories in self.dec_stories.items():
             split = split.replace("_", "")
-            seeds[split] = [story.seed for story in stories]
+            seeds[split] = stories.seeds.tolist()
         
         seed_file = self.out_dir / "seeds.json"
         json.dump(seeds, seed_file.open(mode="w"))
@@ -286,7 +344,7 @@ class StoryWriter(object):
     @property
     def uids_to_write(self):
         if not self._uids_to_write:
-            return self.dec_map_by_uid
+            return self.dec_stories
         else:
             return self._uids_to_write
         
@@ -302,55 +360,45 @@ class StoryWriter(object):
         return uid in self.uids_to_write[split]
         
 
-    def subsample_stories(self, subsample_pct: float):
+    def start_subsample(self, n_samples: int, subsample_pct: float):
+        """
+        Start reservoir sampling the uids of the split's stories as they are
+        accepted. At most `n_samples` stories are generated (one per sample or more),
+        so the reservoir holds `subsample_pct` of them.
+        """
+        self._subsampler = ReservoirSampler(int(np.ceil(n_samples * subsample_pct)), self.subsample_rng)
+
+    def subsample_split(self, split: str, subsample_pct: float):
         """
-        For each split, select `subsample_pct` uids to write (min=1).
+        Select `subsample_pct` of the split's uids to write (min=1), out of the
+        uids reservoir sampled while the split was generated.
         """ 
-        for split, stories_map in sorted(self.dec_map_by_uid.items(), key=lambda x: x[0]):
-            n_stories_to_take = int(np.ceil(len(stories_map) * subsample_pct))
-            selected_uids = choice_np_rng(stories_map.keys(), self.story_seeds_rng, 
-            n_stories_to_take, replace=False)
-            self._uids_to_write[split] = {u: True for u in selected_uids}
+        sampler, self._subsampler = self._subsampler, None
+        n_stories_to_take = int(np.ceil(sampler.n_seen * subsample_pct))
+        self._uids_to_write[split] = set(sampler.sample(n_stories_to_take))
     
     def build_world(self, params=None):
         params = self.params if not params else params
-        world = init_world(params, self.vars)
+        world = init_world(params, self.vars, output_formats=self.config.output_formats)
         return world
     
-    def write_dec_stories(self):
-        for split, stories in self.dec_stories.items():
-            wr_split = split
-            if split == "valid":
-                wr_split = "dev" # switch to conform to tt format
-            dec_split_file = self.out_dir / (f"dec_{wr_split}.jsonl")
-            json_stories = [dec_story.to_json() for dec_story in stories if self.subsample_uid(split, dec_story.uid)]
-            dec_split_file.write_text("\n".join(json_stories))
-            
-    def write_tt_format(self):
-        for split, stories in self.dec_stories.items():
-            json_stories = []
-            wr_split = split
-            if split == "valid":
-                wr_split = "dev" # switch to conform to tt format
-            split_file = self.out_dir / (f"{wr_split}.jsonl")
-            for dec_story in stories:
-                if self.subsample_uid(split, dec_story.uid):
-                    json_stories += [ti.to_json() for ti in 
-                                         dec_story_to_transformer_inputs(dec_story)
-                                         ]
-            split_file.write_text("\n".join(json_stories))
-            
-    
-    def write_babi_from_dec(self):
-        for split, stories in self.dec_stories.items():
-            babi_split_file = self.out_dir / (f"{split}.txt")
-            babi_stories = ["".join(dec_story.babi_story) for dec_story in stories 
-                            if self.subsample_uid(split, dec_story.uid)]
-            babi_split_file.write_text("".join(babi_stories))
-        
-        
-        
-        
+    def add_story(self, split: str, dec_story: DECStory, world: World = None,
+                  old_new_map: Dict[int, int] = None):
+        """
+        Record an accepted story, and write it out immediately if streaming outputs.
+        If writing belief matrices, those of `world` (the story's world) are written,
+        at the timesteps kept in `dec_story` if it was filtered (`old_new_map`).
+        """
+        self.dec_stories[split].append(dec_story)
+        if self._subsampler:
+            self._subsampler.add(dec_story.uid)
+        if self._split_writer:
+            self._split_writer.write_story(dec_story)
+        if self._belief_writer and world:
+            # timesteps of the generated story (before filtering)
+            n_timesteps = max(list(world.history.keys()) + list(world.q_history.keys()) + [0])
+            self._belief_writer.write_story(dec_story, world.diff_props, n_timesteps=n_timesteps,
+                                            old_new_map=old_new_map)
     
     def write_data(self):
         """
@@ -371,42 +419,43 @@ class StoryWriter(object):
             # reset filter in case counting types of stories generated        
             self.story_filter.reset()
             
+            # stream accepted stories to the split's output files as they pass,
+            # or sample the ones to write as they pass if sub-sampling
+            subsample = not self.no_write and self.config.story_subsample_pct < 1
+            if self.stream_outputs:
+                self._split_writer = self.open_split_writer(split, tee=True)
+            if subsample:
+                self.start_subsample(self.params.samples, self.config.story_subsample_pct)
+            if not self.no_write and self.config.write_belief_npy:
+                self._belief_writer = BeliefNpyWriter(self.out_dir, split, world.prop2idx)
     
-            data = self.generate_data(world, self.params,
-                                              self.params.exhaustive, split, use_new_engine=self.config.use_new_engine)
-            
-            
-            samples = "".join(data)
+            try:
+                self.generate_data(world, self.params,
+                                   self.params.exhaustive, split, use_new_engine=self.config.use_new_engine)
+            finally:
+                if self._split_writer:
+                    self._split_writer.__exit__(*sys.exc_info())
+                    self._split_writer = None
+                # belief rows are committed once the stories to write are known
+                belief_writer, self._belief_writer = self._belief_writer, None
+                if belief_writer and sys.exc_info()[0] is not None:
+                    belief_writer.__exit__(*sys.exc_info())
             
-            
-            if not self.no_write:
-                
-                if not self.filtering:
-                    out_fp = self.out_dir / (split + ".txt")
-                    out_fp.write_text(samples)
-        
+            # if sub-sampling, write the sampled stories out of the spill store
+            if subsample:
+                self.subsample_split(split, self.config.story_subsample_pct)
+                print(f"Writing subsampled {split} stories...")
+                with self.open_split_writer(split, tee=True) as writer:
+                    writer.write_stories(dec_story for dec_story in self.dec_stories[split]
+                                         if self.subsample_uid(split, dec_story.uid))
+            if belief_writer:
+                belief_writer.commit(keep_uid=(lambda uid: self.subsample_uid(split, uid)) if subsample else None)
                     
 
         if not self.no_write:
 
             # write seeds used for generation of each story, for reproduceability
             self.write_seeds()
-
-            # if sub-sampling, select seeds to write out of generated stories
-            if self.config.story_subsample_pct < 1:
-                self.subsample_stories(self.config.story_subsample_pct)
-            
-            if self.filtering:
-                print("Writing filtered stories in bAbI format...")
-                self.write_babi_from_dec()
-            
-            if self.config.write_dec:
-                print("Writing stories in DEC format...")
-                self.write_dec_stories()
-            
-            if self.config.write_tt:
-                print("Writing stories in TT format...")
-                self.write_tt_format()
             
     
     
@@ -421,18 +470,19 @@ class StoryWriter(object):
     def generate_data(self, world, params, exhaustive: bool = False,
                       split: str = None, use_new_engine: bool = False):
         """
-        Generates a string of concatenated bAbI-style stories (data) according to the specifications in params and the
-        members and attributes of world.
+        Generates bAbI-style stories according to the specifications in params and the
+        members and attributes of world. Accepted stories are added to `self.dec_stories[split]`.
         :param world: A World object
         :param params: A StoryParameters object
         :param exhaustive: Whether to generate questions exhaustively, or not
         :param split: Split (train/test/valid) this story belongs to
-        :return:
+        :return: The store of accepted stories for the split.
         """
-        data = []
         used_seeds = set()
         seeds_counter = 0
-        self.dec_stories[split] = []
+        if split in self.dec_stories:
+            self.dec_stories[split].close()
+        self.dec_stories[split] = SpilledStoryStore(self.config.spill_dir, name=f"dec_{split}")
         
         c = 0
         
@@ -518,9 +568,8 @@ class StoryWriter(object):
                 if self.story_filter.is_active:
                     passed_filter, filtered_dec_story = self.story_filter.filter_story(dec_story)
                     if passed_filter:
-                        data += story
-                        self.dec_stories[split].append(filtered_dec_story)
-                        self.dec_map_by_uid[split][filtered_dec_story.uid] = filtered_dec_story
+                        self.add_story(split, filtered_dec_story, world,
+                                       old_new_map=self.story_filter.last_old_new_map)
 
                                                 
                         n_qs = self.sample_count - current_count # new qs
@@ -534,9 +583,7 @@ class StoryWriter(object):
                     exhausted_search = True
                     
             else:
-                data += story
-                self.dec_stories[split].append(dec_story)
-                self.dec_map_by_uid[split][dec_story.uid] = dec_story
+                self.add_story(split, dec_story, world)
 
 
                 self._sample_count += 1
@@ -546,5 +593,5 @@ class StoryWriter(object):
         if self.filtering:
             print(f"Number of unique q sigs: {self.story_filter.num_sigs}. Num unique seeds checked: {seeds_counter}. Exhausted search: {exhausted_search}")
             print(f"Filter stats: {self.story_filter.get_stats()}")
-        return data
+        return self.dec_stories[split]
 
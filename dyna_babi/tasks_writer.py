@@ -1,8 +1,12 @@
 from pathlib import Path
 from typing import List, Dict, Optional, Union
 import json
+import math
 import logging
+import os
+import re
 import shutil
+import sys
 from collections import defaultdict
 from dataclasses import dataclass, field
 from dataclasses_json import dataclass_json
@@ -15,6 +19,11 @@ from .game_variables_parser import StoryParameters, GameVariables
 from .story_writer import StoryWriter, StoryWriterConfig
 from .story_filter import FilterConfig
 from .helpers.sst.instance_sst import SSTSampleOptions
+from .helpers.compression import open_text, with_compression_suffixes, path_compression
+from .helpers.compression import compress_bytes, copy_file_data, COPY_BUFSIZE
+from .helpers.stream_writers import CombinedWriters
+from .helpers.belief_npy import BELIEF_STORIES_SUFFIX
+from .helpers.combine_order import combine_files_ordered, check_combine_order
 
 logging.basicConfig(level = logging.INFO)
 
@@ -39,9 +48,14 @@ class TasksConfig:
     out_dir: str = "default"
     write_tt: bool = False
     write_dec: bool = False
+    write_columnar: bool = False
+    write_belief_npy: bool = False
+    compression: Optional[str] = None # gzip, xz or zstd
     no_write: bool  = False
     only_dev: bool = False
     combine_files: bool = False
+    combine_order: str = "concat" # concat, shuffle or interleave (stories of all tasks)
+    combine_seed: int = 0
     just_combine: bool = False # don't write 
     save_separate: bool = True
     use_new_engine: bool = False
@@ -55,6 +69,7 @@ class TasksConfig:
             print("At least `combine_files` or `save_separate` must be True, "
                   "forcing save_separate=True...")
             self.save_seperate = True
+        check_combine_order(self.combine_order)
     
     def to_pretty_json(self) -> str:
         return json.dumps(self.to_dict(), indent=4, sort_keys=True)
@@ -80,11 +95,39 @@ class TasksConfig:
         
     
 def combine_files(source_files: List[Path], target_file: Path):
-    for f in source_files:
-        data = f.read_text()
-        data += "\n"
-        with target_file.open("a+") as f_out:
-            f_out.write(data)
+    # source and target files may be compressed, inferred by file suffix
+    target_compression = path_compression(target_file)
+    if target_compression and any(path_compression(f) != target_compression for f in source_files):
+        # recompress all sources into a single compressed stream appended to the target
+        with open_text(target_file, "a", compression=target_compression) as f_out:
+            for f in source_files:
+                with open_text(f) as f_in:
+                    for chunk in iter(lambda: f_in.read(COPY_BUFSIZE), ""):
+                        f_out.write(chunk)
+                f_out.write("\n")
+        return
+    
+    # unbuffered, and not in append mode, which sendfile doesn't support
+    with target_file.open("r+b" if target_file.exists() else "wb", buffering=0) as f_out:
+        f_out.seek(0, os.SEEK_END)
+        for f in source_files:
+            if path_compression(f) == target_compression:
+                # concatenated compressed streams are valid compressed files, so
+                # files can be copied as is
+                with f.open("rb") as f_in:
+                    copy_file_data(f_in, f_out)
+            else:
+                # uncompressed target
+                with open_text(f) as f_in:
+                    for chunk in iter(lambda: f_in.read(COPY_BUFSIZE), ""):
+                        f_out.write(chunk.encode("utf-8"))
+            f_out.write(compress_bytes(b"\n", target_compression))
+
+
+def task_order_key(file_path: Path, out_path: Path):
+    # task dirs are named <task number>_<task name>
+    match = re.match(r"(\d+)_", file_path.relative_to(out_path).parts[0])
+    return (int(match.group(1)) if match else math.inf, str(file_path))
     
 
 
@@ -100,6 +143,9 @@ class TasksWriter:
                 sw_config = StoryWriterConfig(out_dir=str(task_out_dir),
                                               write_tt=tasks_config.write_tt,
                                               write_dec=tasks_config.write_dec,
+                                              write_columnar=tasks_config.write_columnar,
+                                              write_belief_npy=tasks_config.write_belief_npy,
+                                              compression=tasks_config.compression,
                                               no_write=tasks_config.no_write,
                                               use_new_engine=tasks_config.use_new_engine,
                                               only_dev=tasks_config.only_dev
@@ -139,21 +185,32 @@ class TasksWriter:
     def combine_tasks(self):
         files = defaultdict(list)
         
-        # collect babi format task files (.txt)
-        for file_path in self.tasks_config.out_path.glob("**/*.txt"):
-            if (("train" in file_path.stem) or 
-                ("test" in file_path.stem) or 
-                ("valid" in file_path.stem)):
-                files[file_path.name].append(file_path)
+        # collect babi format task files (.txt), possibly compressed
+        for pattern in with_compression_suffixes(["**/*.txt"]):
+            for file_path in self.tasks_config.out_path.glob(pattern):
+                if (("train" in file_path.stem) or 
+                    ("test" in file_path.stem) or 
+                    ("valid" in file_path.stem)):
+                    files[file_path.name].append(file_path)
         
-        # collect dec/tt format task files if exist (.jsonl)
-        for file_path in self.tasks_config.out_path.glob("**/*.jsonl"):
-            files[file_path.name].append(file_path)
+        # collect dec/tt format task files if exist (.jsonl), belief matrix indices
+        # refer to rows of their task's .npy file so aren't combined
+        for pattern in with_compression_suffixes(["**/*.jsonl"]):
+            for file_path in self.tasks_config.out_path.glob(pattern):
+                if not file_path.name.endswith(BELIEF_STORIES_SUFFIX):
+                    files[file_path.name].append(file_path)
             
         
         
+        # combine in task order, excluding previously combined files
+        combined_dir = self.combined_dir
+        for fname in list(files.keys()):
+            files[fname] = sorted([f for f in files[fname] if combined_dir not in f.parents],
+                                  key=lambda f: task_order_key(f, self.tasks_config.out_path))
+            if not files[fname]:
+                del files[fname]
+        
         # create file
-        combined_dir = self.out_dir / "combined"
         combined_dir.mkdir(exist_ok=True, parents=True)
             
         
@@ -161,17 +218,27 @@ class TasksWriter:
         for fname, format_files in files.items():
             logging.info(f"Combining {len(format_files)} {fname} files: {format_files}")
             dest = combined_dir / fname
-            combine_files(source_files=format_files, target_file=dest)
+            if self.tasks_config.combine_order == "concat":
+                combine_files(source_files=format_files, target_file=dest)
+            else:
+                combine_files_ordered(source_files=format_files, target_file=dest,
+                                      order=self.tasks_config.combine_order,
+                                      seed=self.tasks_config.combine_seed)
             
         
-        # save config file
-        out_param_file = combined_dir / "tasks_config.json"
-        out_param_file.write_text(self.tasks_config.to_pretty_json())
-            
-    
+        self.write_combined_config()
         
         return files
     
+    @property
+    def combined_dir(self) -> Path:
+        return self.out_dir / "combined"
+    
+    def write_combined_config(self):
+        # save config file
+        out_param_file = self.combined_dir / "tasks_config.json"
+        out_param_file.write_text(self.tasks_config.to_pretty_json())
+    
     def generate(self):
 
         self.generate_tasks()
@@ -181,15 +248,29 @@ class TasksWriter:
         if not self.no_write and not self.tasks_config.just_combine:
             self.prepare_out_dir()
         
+        # combine files while generating, by teeing each task's outputs to the combined files
+        # (shuffled/interleaved files are combined once all tasks are written)
+        tee_combined = self.tasks_config.combine_files and not self.no_write \
+            and not self.tasks_config.just_combine and self.tasks_config.combine_order == "concat"
+        
         if not self.tasks_config.just_combine:
-            for story_writer in self.story_writers:
-                story_writer.write_data()
+            combined_writers = CombinedWriters(self.combined_dir, self.tasks_config.compression) \
+                if tee_combined else None
+            try:
+                for story_writer in self.story_writers:
+                    story_writer.combined_writers = combined_writers
+                    story_writer.write_data()
+            finally:
+                if combined_writers:
+                    combined_writers.__exit__(*sys.exc_info())
         else:
             # if just combining - don't write any stories
             logging.info(f"Skipping data generation- just combining existing data at {self.tasks_config.out_path}")
             
         if not self.no_write:
-            if self.tasks_config.combine_files:
+            if tee_combined:
+                self.write_combined_config()
+            elif self.tasks_config.combine_files:
                 self.combine_tasks()
         
             if not self.tasks_config.save_separate:
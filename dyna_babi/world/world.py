@@ -1,13 +1,37 @@
-from typing import List, Set
+from typing import Iterable, List, Optional, Set, Tuple
 import numpy.random as random
 from collections import defaultdict
+from functools import lru_cache
 from itertools import combinations
 from ..helpers.utils import choice_np, sorted_item_set
 from ..helpers.event import Event
 from ..helpers.sst.proposition import ProbProposition 
+from ..helpers.prop_cache import cached_props
 from ..helpers.event_calc import DECStory, from_world_event, from_world_q_event
 from ..Entities import Entity
 
+# output formats built from the propositions of stories (`World.diff_props`)
+PROP_OUTPUT_FORMATS = frozenset({"sst", "sst_vt", "sst_qa", "belief_npy"})
+
+def tracks_props(output_formats: Optional[Iterable[str]]) -> bool:
+    """
+    Whether worlds writing `output_formats` should track propositions (all
+    formats if None).
+    """
+    return output_formats is None or bool(PROP_OUTPUT_FORMATS.intersection(output_formats))
+
+# kinds of entity pairs with propositions, which only depend on the entities' names
+PAIR_KINDS = {("object", "person"), ("object", "location"), ("person", "location")}
+
+@lru_cache(maxsize=65536, typed=True)
+def _pair_props(a_kind: str, a_name: str, b_kind: str, b_name: str, 
+                belief: float) -> Tuple[ProbProposition, ...]:
+    if a_kind == "object" and b_kind == "person":
+        return (ProbProposition(name="held", args=(a_name, b_name), belief=belief),)
+    elif b_kind == "location" and a_kind in ["object", "person"]:
+        return (ProbProposition(name="at", args=(a_name, b_name), belief=belief),)
+    return ()
+
 def prop_factory(a: Entity, b: Entity, belief: float = 1.0, try_reverse: bool = False) -> List[ProbProposition]:
     """
     Return list of propositions that hold between two entities based on their types.
@@ -28,15 +52,14 @@ def prop_factory(a: Entity, b: Entity, belief: float = 1.0, try_reverse: bool =
         List of propositions that hold for entities a, b.
 
     """
-    props = []
-    if a.kind == "object" and b.kind == "person":
-        props += [ProbProposition(name="held", args=(a.name, b.name), belief=belief)]
-    elif b.kind == "location" and a.kind in ["object", "person"]:
-        props += [ProbProposition(name="at", args=(a.name, b.name), belief=belief)]
-    elif b.kind == "indef_location" and a.kind == "person":
+    if b.kind == "indef_location" and a.kind == "person":
         # result of indef action
-        props += [ProbProposition(name="at", args=(a.name, b.location1.name), belief=0.5),
-                  ProbProposition(name="at", args=(a.name, b.location2.name), belief=0.5)]
+        props = [ProbProposition(name="at", args=(a.name, b.location1.name), belief=0.5),
+                 ProbProposition(name="at", args=(a.name, b.location2.name), belief=0.5)]
+    elif (a.kind, b.kind) in PAIR_KINDS:
+        props = list(_pair_props(a.kind, a.name, b.kind, b.name, belief))
+    else:
+        props = []
     if try_reverse:
         props += prop_factory(b, a, belief, try_reverse=False)
     
@@ -45,15 +68,18 @@ def prop_factory(a: Entity, b: Entity, belief: float = 1.0, try_reverse: bool =
 def create_prop_maps(entities):
         """ 
         Create maps of proposition to idx and vice versa for all entities in the world.
+        The propositions are cached by the entities' names and kinds (see `prop_cache`).
         """
+        def create_props() -> List[str]:
+            props = []
+            for a, b in combinations(entities, 2):
+                props += [p.realization for p in prop_factory(a, b, try_reverse=True)]
+            # ensure deterministic given same entity set
+            return sorted(list(set(props)))
+        
         prop2idx = {}
         idx2prop = {}
-        props = []
-        for a, b in combinations(entities, 2):
-            props += [p.realization for p in prop_factory(a, b, try_reverse=True)]
-        
-        # ensure deterministic given same entity set
-        for i, p in enumerate(sorted(list(set(props)))):
+        for i, p in enumerate(cached_props(entities, create_props)):
             prop2idx[p] = i
             idx2prop[i] = p
         
@@ -67,7 +93,8 @@ class World(object):
     coherent rules. The desired dataset we wish to create simply describes bAbI games.
     The world object contains all entities, actions, questions and rules that governs a bAbI game in this world.
     """
-    def __init__(self, entities=None, action_list=None, question_list=None, params=None):
+    def __init__(self, entities=None, action_list=None, question_list=None, params=None,
+                 output_formats: Optional[Iterable[str]] = None):
         self.entities = entities
         self.action_list = action_list
         self.question_list = question_list
@@ -78,13 +105,24 @@ class World(object):
         self.ent_map = {}
         self.locations = []
         self.known_items_history = {}
+        # propositions whose belief changed at each timestep, only tracked if
+        # needed for `output_formats`
+        self.track_props = tracks_props(output_formats)
         self.diff_props = defaultdict(list)
         self.current_seed = -1
         self.idx2prop = None
         self.prop2idx = None
+        self._index_entities()
+
+    def _index_entities(self):
+        # name -> entity (the first one, if names repeat)
+        self.name2entity = {}
+        for entity in (self.entities or []):
+            self.name2entity.setdefault(entity.name, entity)
 
     def populate(self, entities):
         self.entities = entities
+        self._index_entities()
         self.allocate()
         self.idx2prop, self.prop2idx = create_prop_maps(self.entities)
         self.ent_map = {e.name: e.kind for e in entities}
@@ -176,6 +214,7 @@ class World(object):
 
     def add_entity(self, entity):
         self.entities.add(entity)
+        self.name2entity.setdefault(entity.name, entity)
 
     def add_known_item(self, a, b, kind = None, match_location = None, 
                        only_world_record: bool = False):
@@ -185,7 +224,8 @@ class World(object):
         """
         if not only_world_record:
             self.question_list.add_known_item(a, b, match_location=match_location)
-        self.diff_props[self.timestep] = list(set(self.diff_props[self.timestep]).union(set(prop_factory(a, b))))
+        if self.track_props:
+            self.diff_props[self.timestep] = list(set(self.diff_props[self.timestep]).union(set(prop_factory(a, b))))
         
 
     def remove_known_item(self, a, b, only_world_record: bool = False, belief_prob: float = 0.0):
@@ -195,7 +235,8 @@ class World(object):
         """
         if not only_world_record:
             self.question_list.remove_known_item(a, b)
-        self.diff_props[self.timestep] += prop_factory(a, b, belief=belief_prob)
+        if self.track_props:
+            self.diff_props[self.timestep] += prop_factory(a, b, belief=belief_prob)
         
         
     def update_all_neg_poss(self, a, pos_poss = None, only_world_record: bool = True,
@@ -279,7 +320,7 @@ class World(object):
         return zip(*all_qs)
 
     def get_entity_by_name(self, name):
-        return [entity for entity in self.entities if entity.name == name][0]
+        return self.name2entity[name]
 
     def get_action_by_kind(self, kind):
         return [action for action in self.action_list.actions if action.kind == kind][0]
@@ -42,6 +42,25 @@ def parse_args():
         action='store_true',
         default=False
     )
+    parser.add_argument(
+        "--compression",
+        help="Compress output files, one of gzip, xz or zstd (requires zstandard). (default: None)",
+        type=str,
+        choices=["gzip", "xz", "zstd"],
+        default=None
+    )
+    parser.add_argument(
+        "--write_columnar",
+        help="Flag controlling whether to write question/sentence tables in Parquet format, requires pyarrow. (default: False)",
+        action='store_true',
+        default=False
+    )
+    parser.add_argument(
+        "--write_belief_npy",
+        help="Flag controlling whether to write belief matrices (timestep x proposition) of stories in .npy format. (default: False)",
+        action='store_true',
+        default=False
+    )
 
     
     parser.add_argument(
@@ -50,6 +69,19 @@ def parse_args():
         action='store_true',
         default=False
     )
+    parser.add_argument(
+        "--combine_order",
+        help="Order of stories in combined files: concat (task by task), shuffle or interleave (round-robin over tasks). (default: concat)",
+        type=str,
+        choices=["concat", "shuffle", "interleave"],
+        default=None
+    )
+    parser.add_argument(
+        "--combine_seed",
+        help="Seed of the shuffled combine order. (default: 0)",
+        type=int,
+        default=None
+    )
     parser.add_argument(
         "--erase_separate",
         help="Erase separate folders per task. (default: False)",
@@ -84,6 +116,15 @@ def parse_args():
     if args.write_dec:
         tasks_config.write_dec = True
         
+    if args.write_columnar:
+        tasks_config.write_columnar = True
+        
+    if args.write_belief_npy:
+        tasks_config.write_belief_npy = True
+        
+    if args.compression:
+        tasks_config.compression = args.compression
+        
     
 
     if args.use_new_engine:
@@ -103,6 +144,12 @@ def parse_args():
 
     if args.combine_files:
         tasks_config.combine_files = True
+        
+    if args.combine_order:
+        tasks_config.combine_order = args.combine_order
+        
+    if args.combine_seed is not None:
+        tasks_config.combine_seed = args.combine_seed
 
     return tasks_config
 
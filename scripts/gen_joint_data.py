@@ -3,7 +3,7 @@ Script to generate concatenations of babi tasks.
 
    
 Usage:
-    gen_joint_data.py TASKS [--babi_dir=<babi_dir> --out_dir=<out_dir>]
+    gen_joint_data.py TASKS [--babi_dir=<babi_dir> --out_dir=<out_dir> --order=<order> --seed=<seed>]
     
 
 Options:
@@ -11,6 +11,8 @@ Options:
    TASKS         Comma separated task numbers (e.g., [1,20])
    --babi_dir=<babi_dir>    Directory babi data is located at [default: data]
    --out_dir=<out_dir>      Output directory for resulting data. [default: data/concat_bAbI]
+   --order=<order>          Order of stories: concat (task by task), shuffle or interleave (round-robin over tasks). [default: concat]
+   --seed=<seed>            Seed of the shuffled order. [default: 0]
 
 """
 
@@ -20,12 +22,17 @@ import sys
 ROOT = Path(__file__).parents[1]
 sys.path.append(str(ROOT))
 
+from dyna_babi.helpers.combine_order import combine_files_ordered, check_combine_order
+
 if __name__ == "__main__":
     
     arguments = docopt(__doc__, version='0.1')
     
     rel_babi_path = arguments.get('--babi_dir')
     rel_out_dir = arguments.get('--out_dir')
+    order = arguments.get('--order')
+    seed = int(arguments.get('--seed'))
+    check_combine_order(order)
     babi_data_dir = ROOT / rel_babi_path / "tasks_1-20_v1-2" / "en-valid-10k"
     
     # get tasks to concat
@@ -43,11 +50,6 @@ if __name__ == "__main__":
         "test": out_dir / f"{dir_name}_test.txt"
         }
     
-    # initialize output files
-    for out_file in out_files.values():
-        out_file.open(mode="w")
-    
-    
     # save the files here first to write in order
     task_files = []
     for task_file in babi_data_dir.iterdir():
@@ -59,13 +61,23 @@ if __name__ == "__main__":
     task_files.sort(key=lambda x: x[0])
     
     
-    # write task data
-    for task_num, split, task_file in task_files:
-        task_data = task_file.read_text()
-        out_file = out_files[split]
-        print(f"Writing {task_num} {split} to {out_file}...")
-        with out_file.open("a") as f:
-                f.write(task_data)
+    if order != "concat":
+        for split, out_file in out_files.items():
+            split_files = [task_file for _, s, task_file in task_files if s == split]
+            print(f"Writing {order} of {len(split_files)} {split} files to {out_file}...")
+            combine_files_ordered(split_files, out_file, order=order, seed=seed)
+    else:
+        # initialize output files
+        for out_file in out_files.values():
+            out_file.open(mode="w")
+        
+        # write task data
+        for task_num, split, task_file in task_files:
+            task_data = task_file.read_text()
+            out_file = out_files[split]
+            print(f"Writing {task_num} {split} to {out_file}...")
+            with out_file.open("a") as f:
+                    f.write(task_data)
                 
     print("Done!")
         
@@ -3,7 +3,8 @@ questions.
 
 Usage:
   solve_babi_tasks.py DATA_PATH [--task_configs=<task_configs> --odir=<odir>]
-                                  [--no_decs --trim_over] [(-v | --verbose)]
+                                  [--no_decs --trim_over --n_workers=<n_workers>]
+                                  [--length_tokenizer=<kind> --tokenizer=<tokenizer>] [(-v | --verbose)]
   
   solve_babi_tasks.py (-h | --help)
 
@@ -15,6 +16,11 @@ Options:
   --odir=<odir>  Output dir [default: none].
   --no_decs  Don't create DEC format files.
   --trim_over  Trim stories over max limit of 500 tokens.
+  --length_tokenizer=<kind>  Tokenizer for length checking: hf (requires transformers), wordpiece 
+                             (local, --tokenizer is a vocab file) or whitespace [default: hf].
+  --tokenizer=<tokenizer>  Tokenizer name/path for hf (bert-base-uncased if not given), or vocab file
+                           for wordpiece (required).
+  --n_workers=<n_workers>  Number of solver processes, 0 to use all cores [default: 1].
 
 """
 from typing import List, Dict, Any
@@ -35,8 +41,8 @@ from dyna_babi.solver import solve_story, DumbSolver
 from dyna_babi.game_variables_parser import StoryParameters, GameVariables
 from dyna_babi.helpers.transformer_preproc import dec_story_to_transformer_inputs, TransformerInstance
 from dyna_babi.helpers.event_calc import DECStory, DECEvent, filter_keep_timesteps
-
-from transformers import BertTokenizer
+from dyna_babi.helpers.codec import encode_dec_story, encode_transformer_instance
+from dyna_babi.helpers.length_oracle import LengthOracle, load_tokenizer
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -52,9 +58,8 @@ def filter_long_dec(dec: DECStory, max_len: int = 500) -> DECStory:
     Filter stories to remove questions over the maximum length handled by transformers.
     """
     
-    # convert dec to list of transformer inputs and get their lengths
-    tis = dec_story_to_transformer_inputs(dec)
-    lengths = [len(tokenizer.tokenize(ti.input)) for ti in tis]
+    # get token lengths of the story's transformer inputs
+    lengths = length_oracle.question_lengths(dec)
     
     assert(len(lengths) == len(dec.question_sent_idxs()))
     
@@ -92,7 +97,7 @@ def write_tt_format(output_dir, dec_stories):
             wr_split = "dev" # switch to conform to tt format
         split_file = output_dir / (f"{wr_split}.jsonl")
         for dec_story in stories:
-            json_stories += [ti.to_json() for ti in \
+            json_stories += [encode_transformer_instance(ti) for ti in \
                              dec_story_to_transformer_inputs(dec_story)
                                  ]
         split_file.write_text("\n".join(json_stories))
@@ -104,7 +109,7 @@ def write_dec_stories(output_dir, dec_stories):
         if split == "valid":
             split = "dev" # switch to conform to tt format
         dec_split_file = output_dir / (f"dec_{split}.jsonl")
-        json_stories = [dec_story.to_json() for dec_story in stories]
+        json_stories = [encode_dec_story(dec_story) for dec_story in stories]
         print(f"Writing {len(json_stories)} to {split}...")
         dec_split_file.write_text("\n".join(json_stories))
 
@@ -152,6 +157,9 @@ if __name__ == '__main__':
     write_decs = not args.get("--no_decs")
     verbose = args.get("--verbose")
     trim_over_len = args.get("--trim_over")
+    length_tokenizer = args.get("--length_tokenizer")
+    tokenizer_name = args.get("--tokenizer")
+    n_workers = int(args.get("--n_workers")) or os.cpu_count()
     
     all_filtered = Counter()
     q_counts = Counter()
@@ -159,12 +167,17 @@ if __name__ == '__main__':
     if verbose:
         logger.setLevel(level=logging.DEBUG)
     
+    if trim_over_len and length_tokenizer == "wordpiece" and not tokenizer_name:
+        sys.exit("--length_tokenizer=wordpiece requires a vocab file, given with --tokenizer=<vocab file>")
+    
     if trim_over_len:
         logger.info("Loading tokenizer to check story length...")
         # any tokenizer will do, just for length checking
-        tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
+        tokenizer = load_tokenizer(length_tokenizer, tokenizer_name)
+        length_oracle = LengthOracle(tokenizer)
     else:
         tokenizer = None
+        length_oracle = None
         
     tasks_config = SolverConfig() if task_configs == "none" else SolverConfig.from_file(task_configs)
     
@@ -191,7 +204,8 @@ if __name__ == '__main__':
         else:
             params = StoryParameters()
         
-        ds = DumbSolver(story_params=params, inject_qs=inject_qs)
+        ds = DumbSolver(story_params=params, inject_qs=inject_qs, n_workers=n_workers,
+                        output_formats={"dec"})
         
         # load task data in babi format
         for data_file in babi_data_path.glob(f"{task}_*.txt"):
@@ -210,6 +224,7 @@ if __name__ == '__main__':
                 
             
             if trim_over_len:
+                length_oracle.add_stories(res["decs"])
                 processed_decs, filtered_cnts = zip(*[filter_long_dec(dec, TOKEN_LENGTH_LIMIT) \
                                                       for dec in res["decs"]])
                 all_filtered[split] += sum(filtered_cnts)